@@ -1,13 +1,21 @@
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
-from PIL import Image
-import numpy as np
-import faiss
-import json
+from fastapi import FastAPI, HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, Response
+import asyncio
+import io
+import queue
 import random
 import os
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from sessions import SessionLocks
+from thumbnails import ThumbnailCache, SIZES as THUMBNAIL_SIZES, etag_matches
+from moodboard import FORMATS as MOODBOARD_FORMATS
+from concurrency import EndpointLimiter
+from corpus import Corpus
+from snapshot import Snapshot, CorpusReloader
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, stage
 
 app = FastAPI()
 
@@ -18,56 +26,324 @@ app.add_middleware(
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
 )
+app.add_middleware(MetricsMiddleware)  # Request counts and latency per route, served at /metrics
 
-index = faiss.read_index("data/faiss_index.bin")
-embeddings = np.load("data/embeddings.npy")
-with open("data/metadata.json", "r") as f:
-    metadata = json.load(f)
-locked_embedding = None
+# float32 | float16 | int8 (files written by generate_all.py) or "index" to reconstruct from FAISS
+EMBEDDING_DTYPE = os.environ.get("MOODBOARD_EMBEDDINGS", "float32")
+NEIGHBORS_K = 100  # Candidate pool sampled from while an image is locked
+# "graph" serves locked searches from the precomputed k-NN matrix, "faiss"
+# always searches the index, "auto" uses the graph when generate_all.py wrote one
+NEIGHBOR_SOURCE = os.environ.get("MOODBOARD_NEIGHBORS", "auto")
+# GMM clusters from generate_all.py: the default feed samples across them, and
+# locked searches on a large exhaustive (Flat) index can probe only the
+# CLUSTER_NPROBE nearest clusters. MOODBOARD_CLUSTER_SEARCH is auto|on|off
+CLUSTER_SEARCH = os.environ.get("MOODBOARD_CLUSTER_SEARCH", "auto")
+CLUSTER_NPROBE = int(os.environ.get("MOODBOARD_CLUSTER_NPROBE", 4))
+# Full CLIP tag probabilities (tag_probs.npy) rank tag queries; without
+# them tag queries fall back to unranked sampling from the inverted index
+TAG_SEARCH_K = 100  # Best-scoring candidates sampled from on each refresh
+# Queries with words outside the tag vocabulary are answered from the CLIP
+# image index (clip_index.bin) instead of missing; MOODBOARD_TEXT_SEARCH=off disables
+TEXT_SEARCH_K = 100  # Candidate pool sampled from, as for locked searches
+# Seconds between checks for a newly published bundle; 0 disables the watcher
+# (POST /api/admin/reload still works). MOODBOARD_ADMIN_TOKEN guards that endpoint
+RELOAD_INTERVAL = float(os.environ.get("MOODBOARD_RELOAD_INTERVAL", 30))
+ADMIN_TOKEN = os.environ.get("MOODBOARD_ADMIN_TOKEN")
+# POST /api/search/upload embeds an uploaded image with DINOv2, kept warm in a
+# background worker that batches concurrent uploads (models/embedding.py);
+# MOODBOARD_UPLOAD_SEARCH=off skips loading the model
+UPLOAD_SEARCH = os.environ.get("MOODBOARD_UPLOAD_SEARCH", "on") != "off"
+MAX_UPLOAD_BYTES = 10 * 2**20
+
+render_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="moodboard")  # Shared by every generation
+
+def load_snapshot(verify=False):
+    """Load the current data bundle (or legacy flat files) under data/; see corpus.py."""
+    corpus = Corpus.load(
+        "data", embedding_dtype=EMBEDDING_DTYPE,
+        search_params=os.environ.get("MOODBOARD_SEARCH_PARAMS"),
+        verify=verify,
+        text_search=os.environ.get("MOODBOARD_TEXT_SEARCH", "auto") != "off",
+        knn_graph=NEIGHBOR_SOURCE in ("auto", "graph"),
+    )
+    return Snapshot(corpus, neighbors_k=NEIGHBORS_K, neighbor_source=NEIGHBOR_SOURCE,
+                    cluster_search=CLUSTER_SEARCH, cluster_nprobe=CLUSTER_NPROBE, render_pool=render_pool)
+
+# Every request works on reloader.current as it was when the request began;
+# new generations are swapped in whole. MOODBOARD_VERIFY_BUNDLE=1 checksums
+# every file of the first generation too (reloads always do)
+reloader = CorpusReloader(lambda verify: load_snapshot(verify or os.environ.get("MOODBOARD_VERIFY_BUNDLE") == "1"),
+                          "data")
+if RELOAD_INTERVAL > 0:
+    reloader.watch(RELOAD_INTERVAL)
+
+session_locks = SessionLocks()
+thumbnail_cache = ThumbnailCache("data/thumbnails")
+
+# Blocking work (FAISS, tag sampling, PIL) runs on per-endpoint pools so the
+# event loop stays free; each pool admits a bounded queue and then answers 429
+search_limiter = EndpointLimiter("search", int(os.environ.get("MOODBOARD_SEARCH_WORKERS", 16)), max_queue=64)
+save_limiter = EndpointLimiter("save", int(os.environ.get("MOODBOARD_SAVE_WORKERS", 4)), max_queue=8)
+thumbnail_limiter = EndpointLimiter("thumbnails", int(os.environ.get("MOODBOARD_THUMBNAIL_WORKERS", 8)), max_queue=64)
+upload_limiter = EndpointLimiter("upload", int(os.environ.get("MOODBOARD_UPLOAD_WORKERS", 4)), max_queue=32)
+limiters = (search_limiter, save_limiter, thumbnail_limiter, upload_limiter)
+
+if UPLOAD_SEARCH:
+    from models import embedding
+    embedding_worker = embedding.EmbeddingWorker(
+        max_batch=int(os.environ.get("MOODBOARD_EMBED_BATCH", embedding.MAX_BATCH)),
+        max_wait=float(os.environ.get("MOODBOARD_EMBED_WAIT_MS", embedding.MAX_WAIT * 1000)) / 1000)
+else:
+    embedding_worker = None
+
+# Read at scrape time from the state the server already keeps
+def cache_lookups(field):
+    snap = reloader.current
+    caches = {"neighbors": snap.neighbor_cache, "thumbnails": thumbnail_cache.memory,
+              "text_queries": snap.text_search.cache if snap.text_search is not None else None}
+    return {(name,): getattr(cache, field) for name, cache in caches.items() if cache is not None}
+
+REGISTRY.callback("moodboard_corpus_rows", "Images in the served corpus generation.",
+                  lambda: {(): len(reloader.current)})
+REGISTRY.callback("moodboard_corpus_info", "Served corpus generation and how it is searched.",
+                  lambda: {(reloader.current.version or "legacy", type(reloader.current.index).__name__,
+                            reloader.current.neighbor_source, EMBEDDING_DTYPE): 1},
+                  ("version", "index_type", "neighbor_source", "embedding_dtype"))
+REGISTRY.callback("moodboard_corpus_reloads_total", "Corpus reloads by outcome.",
+                  lambda: {("success",): reloader.reloads, ("failure",): reloader.failures}, ("outcome",), "counter")
+REGISTRY.callback("moodboard_cache_hits_total", "Cache hits.", lambda: cache_lookups("hits"), ("cache",), "counter")
+REGISTRY.callback("moodboard_cache_misses_total", "Cache misses.", lambda: cache_lookups("misses"), ("cache",),
+                  "counter")
+REGISTRY.callback("moodboard_sessions", "Sessions holding a lock.", lambda: {(): len(session_locks)})
+REGISTRY.callback("moodboard_limiter_in_flight", "Requests running or queued per endpoint pool.",
+                  lambda: {(limiter.name,): limiter.in_flight for limiter in limiters}, ("pool",))
+REGISTRY.callback("moodboard_limiter_rejected_total", "Requests turned away with 429 per endpoint pool.",
+                  lambda: {(limiter.name,): limiter.rejected for limiter in limiters}, ("pool",), "counter")
+if embedding_worker is not None:
+    REGISTRY.callback("moodboard_embedding_pending", "Uploaded images waiting for the embedding worker.",
+                      lambda: {(): embedding_worker.stats()["pending"]})
+    REGISTRY.callback("moodboard_embedding_batches_total", "DINOv2 forward passes run by the embedding worker.",
+                      lambda: {(): embedding_worker.batches}, kind="counter")
+    REGISTRY.callback("moodboard_embedding_images_total", "Uploaded images embedded.",
+                      lambda: {(): embedding_worker.items}, kind="counter")
+    REGISTRY.callback("moodboard_embedding_seconds_total", "Time spent in DINOv2 forward passes.",
+                      lambda: {(): embedding_worker.seconds}, kind="counter")
 
 class LockRequest(BaseModel):
     image_path: str  # Assuming your frontend sends 'imageId' in the body
+    session_id: str = "default"  # Board/session the lock applies to
 
-@app.get("/api/search")
-async def search(query: str, count: int = 12):
-    print('search query = ', query, ' and count = ', count)
+class UnlockRequest(BaseModel):
+    session_id: str = "default"
+
+class BatchQuery(BaseModel):
+    id: str
+    query: str = ""  # Comma-separated tags, ignored when image_path is set
+    image_path: Optional[str] = None  # Sample from this image's neighbors, as if it were locked
+    count: int = Field(12, ge=1, le=NEIGHBORS_K)
+    mode: str = "or"
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchQuery]
+
+MAX_BATCH_QUERIES = 1024
+
+def search_images(snap, query, count=12, mode="or", facets=False, session_id="default"):
+    """session_id=None ignores session locks (batch queries are stateless)."""
     if query == "":
         query = "default"
-    global locked_embedding
-    if locked_embedding is not None:
-        distances, indices = index.search(locked_embedding, k=100)
-        top_k_indices = indices[0].tolist()
-        if len(top_k_indices) <= count:
-            selected_indices = top_k_indices
-        else:
-            selected_indices = random.sample(top_k_indices, count)
-        return {"images": [metadata[i]["path"] for i in selected_indices]}
+    locked_path = session_locks.get(session_id) if session_id is not None else None
+    # A locked image missing from this generation is treated as unlocked
+    locked_row = snap.id_index.row(locked_path) if locked_path is not None else None
+    if locked_row is not None:
+        with stage("vector_search"):
+            top_k_indices = snap.locked_neighbors(locked_row).tolist()
+        with stage("sampling"):
+            if len(top_k_indices) <= count:
+                selected_indices = top_k_indices
+            else:
+                selected_indices = random.sample(top_k_indices, count)
+        return {"images": [snap.path(i) for i in selected_indices]}
         # return {"images": [metadata[i]["path"] for i in indices[0]]}
-    query_tags = query.split(",")
-    matches = [i for i, meta in enumerate(metadata) if any(tag in meta["tags"] for tag in query_tags)]
-    sample_indices = random.sample(matches, min(count, len(matches)))
-    return {"images": [metadata[i]["path"] for i in sample_indices]}
+    if query == "default":
+        # Diverse feed: spread across clusters when available, else uniform
+        with stage("sampling"):
+            if snap.cluster_index is not None:
+                sample_indices = snap.cluster_index.sample(count)
+            else:
+                sample_indices = random.sample(range(len(snap)), min(count, len(snap)))
+        return {"images": [snap.path(i) for i in sample_indices]}
+    query_tags = [tag.strip() for tag in query.split(",")]
+    if snap.text_search is not None and any(tag not in snap.tag_index.tag_ids for tag in query_tags):
+        with stage("text_search"):
+            candidates = snap.text_search.search(query, TEXT_SEARCH_K)
+        with stage("sampling"):
+            selected = candidates.tolist() if len(candidates) <= count else random.sample(candidates.tolist(), count)
+        result = {"images": [snap.path(i) for i in selected]}
+        if facets:
+            with stage("facets"):
+                result["facets"] = snap.tag_index.facets(candidates)
+        return result
+    if snap.tag_scores is not None:
+        with stage("tag_filter"):
+            candidates = snap.tag_scores.top(query_tags, max(count, TAG_SEARCH_K), mode=mode).tolist()
+        # Keep score order among the sampled candidates
+        with stage("sampling"):
+            sample_indices = candidates if len(candidates) <= count else [
+                candidates[i] for i in sorted(random.sample(range(len(candidates)), count))]
+    else:
+        with stage("tag_filter"):  # Filtering and sampling happen together in the inverted index
+            sample_indices = snap.tag_index.sample(query_tags, count, mode=mode)
+    result = {"images": [snap.path(i) for i in sample_indices]}
+    if facets:
+        # Count over the set the results were drawn from: the ranked candidates, or every match
+        with stage("facets"):
+            rows = candidates if snap.tag_scores is not None else snap.tag_index.rows(query_tags, mode=mode)
+            result["facets"] = snap.tag_index.facets(rows)
+    return result
+
+@app.get("/api/search")
+async def search(query: str, count: int = 12, mode: str = "or", facets: bool = False,
+                 session_id: str = "default"):
+    print('search query = ', query, ' and count = ', count)
+    if mode not in ("or", "and"):
+        raise HTTPException(status_code=422, detail="mode must be 'or' or 'and'")
+    return await search_limiter.run(search_images, reloader.current, query, count, mode, facets, session_id)
+
+def batch_search(snap, queries):
+    results = dict.fromkeys(q.id for q in queries)  # Keep request order in the response
+    vector_queries = []
+    for q in queries:
+        if q.image_path is None:
+            results[q.id] = search_images(snap, q.query, q.count, q.mode, session_id=None)
+            continue
+        row = snap.id_index.row(q.image_path)
+        if row is None:
+            results[q.id] = {"error": f"Image not found: {q.image_path}"}
+        else:
+            vector_queries.append((q, row))
+    with stage("vector_search"):
+        neighbors = snap.batch_neighbors([row for q, row in vector_queries])
+    for q, row in vector_queries:
+        candidates = neighbors[row].tolist()
+        selected = candidates if len(candidates) <= q.count else random.sample(candidates, q.count)
+        results[q.id] = {"images": [snap.path(i) for i in selected]}
+    return {"results": results}
+
+@app.post("/api/search/batch")
+async def search_batch(request_body: BatchSearchRequest):
+    queries = request_body.queries
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    if len({q.id for q in queries}) != len(queries):
+        raise HTTPException(status_code=422, detail="Query ids must be unique")
+    if any(q.mode not in ("or", "and") for q in queries):
+        raise HTTPException(status_code=422, detail="mode must be 'or' or 'and'")
+    return await search_limiter.run(batch_search, reloader.current, queries)
+
+def decode_upload(data):
+    try:
+        return embedding.preprocess(io.BytesIO(data))
+    except Exception as e:  # PIL raises a range of errors on corrupt or unsupported files
+        raise HTTPException(status_code=422, detail=f"Could not read the uploaded image: {e}")
+
+def search_vector(snap, vector, count):
+    with stage("vector_search"):
+        candidates = snap.search_vector(vector).tolist()
+    with stage("sampling"):
+        selected = candidates if len(candidates) <= count else random.sample(candidates, count)
+    return {"images": [snap.path(i) for i in selected]}
+
+@app.post("/api/search/upload")
+async def search_upload(image: UploadFile, count: int = 12):
+    """Images similar to an uploaded one, sampled from its nearest neighbors like a locked search."""
+    if embedding_worker is None:
+        raise HTTPException(status_code=404, detail="Upload search is disabled (MOODBOARD_UPLOAD_SEARCH=off)")
+    data = await image.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Uploads are limited to {MAX_UPLOAD_BYTES // 2**20} MB")
+    tensor = await upload_limiter.run(decode_upload, data)
+    try:
+        future = embedding_worker.submit(tensor)
+    except queue.Full:
+        raise HTTPException(status_code=429, detail="Embedding queue is full, retry shortly",
+                            headers={"Retry-After": "1"})
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    with stage("embedding"):
+        vector = await asyncio.wrap_future(future)
+    return await search_limiter.run(search_vector, reloader.current, vector, count)
 
 @app.post("/api/lock")
 async def lock(request_body: LockRequest):
     image_path = request_body.image_path
-    global locked_embedding
-    idx = next(i for i, meta in enumerate(metadata) if meta["path"] == image_path)
-    locked_embedding = embeddings[idx:idx+1]  # Shape: (1, 768)
+    if reloader.current.id_index.row(image_path) is None:
+        raise HTTPException(status_code=404, detail=f"Image not found: {image_path}")
+    session_locks.lock(request_body.session_id, image_path)
     return {"status": "locked"}
 
+@app.post("/api/unlock")
+async def unlock(request_body: UnlockRequest):
+    session_locks.unlock(request_body.session_id)
+    return {"status": "unlocked"}
+
+@app.post("/api/admin/reload")
+async def reload_corpus(request: Request, force: bool = False):
+    """Swap in the latest published bundle (force: reload even if it is the one being served)."""
+    if ADMIN_TOKEN is not None and request.headers.get("x-admin-token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, reloader.reload, force)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving {reloader.current.version}: {e}")
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    snap = reloader.current
+    return {
+        "corpus": reloader.stats(),
+        "neighbors": snap.neighbor_cache.stats(),
+        "neighbor_source": snap.neighbor_source,
+        "thumbnails": thumbnail_cache.memory.stats(),
+        "text_queries": snap.text_search.cache.stats() if snap.text_search is not None else None,
+        "sessions": len(session_locks),
+        "limiters": {limiter.name: limiter.stats() for limiter in limiters},
+        "embedding": embedding_worker.stats() if embedding_worker is not None else None,
+    }
+
+def render_moodboard(snap, session_id, columns, rows, count, fmt):
+    paths = search_images(snap, "default", count=min(count, columns * rows), session_id=session_id)["images"]
+    return snap.renderer.render(paths, [snap.id_index.row(path) for path in paths], columns, rows, fmt=fmt)
+
 @app.get("/api/save")
-async def save_moodboard():
-    global locked_embedding
-    images = await search("") if locked_embedding is not None else await search("default")
-    imgs = [Image.open(path).resize((200, 200)) for path in images["images"]]
-    combined = Image.new("RGB", (800, 400))  # 4x2 grid
-    for i, img in enumerate(imgs[:7]):
-        combined.paste(img, ((i % 4) * 200, (i // 4) * 200))
-    combined.save("moodboard.png")
-    return FileResponse("moodboard.png")
+async def save_moodboard(session_id: str = "default", columns: int = 4, rows: int = 2,
+                         count: int = 7, format: str = "png"):
+    if not (1 <= columns <= 12 and 1 <= rows <= 12) or format not in MOODBOARD_FORMATS:
+        raise HTTPException(status_code=422, detail=f"columns/rows must be 1-12, format one of {tuple(MOODBOARD_FORMATS)}")
+    data = await save_limiter.run(render_moodboard, reloader.current, session_id, columns, rows, count, format)
+    return Response(content=data, media_type=MOODBOARD_FORMATS[format][1],
+                    headers={"Content-Disposition": f'inline; filename="moodboard.{format}"'})
 
 # Serve images
 @app.get("/api/images/{image_path:path}")
 async def get_image(image_path: str):
-    return FileResponse(os.path.join("data/images", image_path))
\ No newline at end of file
+    return FileResponse(os.path.join("data/images", image_path))
+
+@app.get("/api/thumbnails/{size}/{image_path:path}")
+async def get_thumbnail(size: int, image_path: str, request: Request, format: str = "webp"):
+    if size not in THUMBNAIL_SIZES or format not in ("webp", "jpeg"):
+        raise HTTPException(status_code=400, detail=f"size must be one of {THUMBNAIL_SIZES}, format webp or jpeg")
+    image_dir = os.path.abspath("data/images")
+    source = os.path.abspath(os.path.join(image_dir, image_path))
+    if not source.startswith(image_dir + os.sep) or not os.path.isfile(source):
+        raise HTTPException(status_code=404, detail=f"Image not found: {image_path}")
+    headers = {"Cache-Control": "public, max-age=86400"}
+    etag = thumbnail_cache.etag(source, size, format)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={**headers, "ETag": etag})
+    data, etag = await thumbnail_limiter.run(thumbnail_cache.get, source, size, format)
+    return Response(content=data, media_type=f"image/{format}", headers={**headers, "ETag": etag})
@@ -0,0 +1,18 @@
+"""Benchmarks for the moodboard pipeline and server.
+
+Run from the backend directory, e.g. ``python -m benchmarks.embedding_store``.
+"""
+import numpy as np
+
+import bundle
+
+
+def current_data_dir(data_dir="data"):
+    """Directory of the bundle served from data_dir (data/bundles/CURRENT), else data_dir's legacy flat files."""
+    return bundle.current(data_dir) or data_dir
+
+
+def recall_at_k(reference, candidate):
+    """Fraction of the reference neighbor ids (queries x k) also found in candidate."""
+    hits = sum(len(np.intersect1d(r, c)) for r, c in zip(reference, candidate))
+    return hits / reference.size
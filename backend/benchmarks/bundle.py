@@ -0,0 +1,81 @@
+"""Compare loading metadata.json with loading the columnar bundle metadata.
+
+Writes a synthetic corpus of --rows images (paths plus three tags each) in
+both forms to a temporary directory, then reports load time and the Python
+heap held by the metadata, tag index and path lookup for each.
+
+    python -m benchmarks.bundle --rows 1000000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import bundle
+from id_index import IdIndex
+from tag_index import TagIndex
+
+
+def synthetic_metadata(rows, n_tags=120, seed=0):
+    rng = np.random.default_rng(seed)
+    tags = [f"tag {i}" for i in range(n_tags)]
+    picks = rng.integers(n_tags, size=(rows, 3))
+    return [{"path": f"data/images/site-{i % 97}/project-{i // 97}/image_{i}.jpg",
+             "tags": [tags[j] for j in dict.fromkeys(row)]} for i, row in enumerate(picks.tolist())], tags
+
+
+def measure(load):
+    tracemalloc.start()
+    start = time.perf_counter()
+    loaded = load()
+    seconds = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return loaded, seconds, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    metadata, tags = synthetic_metadata(args.rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "metadata.json"), "w") as f:
+            json.dump(metadata, f)
+        bundle_dir = os.path.join(tmp, "bundle")
+        os.makedirs(bundle_dir)
+        bundle.write_metadata(bundle_dir, metadata, tags)
+        del metadata
+
+        def load_json():
+            with open(os.path.join(tmp, "metadata.json"), "r") as f:
+                loaded = json.load(f)
+            return loaded, TagIndex(loaded), IdIndex.from_metadata(loaded)
+
+        def load_bundle():
+            loaded = bundle.BundleMetadata(bundle_dir, tags)
+            return loaded, TagIndex.from_bundle(loaded), IdIndex.from_bundle(loaded)
+
+        print(f"{args.rows} rows")
+        print(f"{'format':<10} {'load ms':>10} {'heap MB':>9} {'on disk MB':>11} {'lookup us':>10}")
+        for name, load, size in [
+            ("json", load_json, os.path.getsize(os.path.join(tmp, "metadata.json"))),
+            ("bundle", load_bundle, sum(os.path.getsize(os.path.join(bundle_dir, f)) for f in os.listdir(bundle_dir))),
+        ]:
+            (loaded, tag_index, id_index), seconds, held = measure(load)
+            paths = [loaded[i]["path"] for i in range(0, len(loaded), max(1, len(loaded) // 1000))]
+            start = time.perf_counter()
+            for path in paths:
+                id_index.row(path)
+            lookup_us = (time.perf_counter() - start) / len(paths) * 1e6
+            print(f"{name:<10} {seconds * 1000:>10.1f} {held / 2**20:>9.1f} {size / 2**20:>11.1f} {lookup_us:>10.1f}")
+            del loaded, tag_index, id_index
+
+
+if __name__ == "__main__":
+    main()
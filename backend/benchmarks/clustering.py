@@ -0,0 +1,46 @@
+"""Compare clustering backends on the real embeddings.
+
+Reports fit and predict time, cluster size spread, silhouette and
+Davies-Bouldin score (on a row sample) for each backend.
+
+Reads embeddings.npy of the bundle data/bundles/CURRENT points to (or the
+legacy data/embeddings.npy); --embeddings picks another file.
+
+    python -m benchmarks.clustering --clusters 20 faiss minibatch pca-gmm
+    python -m benchmarks.clustering --embeddings data/bundles/<version>/embeddings.npy
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from benchmarks import current_data_dir
+from models.clustering import BACKENDS, Clustering, cluster_quality
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("backends", nargs="*", default=list(BACKENDS), help=f"Any of {BACKENDS}")
+    parser.add_argument("--embeddings", help="Embeddings .npy file (default: the current bundle's)")
+    parser.add_argument("--clusters", type=int, default=20)
+    parser.add_argument("--sample-size", type=int, default=200_000, help="Rows used by sample-based fits")
+    args = parser.parse_args()
+    args.embeddings = args.embeddings or os.path.join(current_data_dir(), "embeddings.npy")
+
+    embeddings = np.load(args.embeddings, mmap_mode="r")
+    print(f"{len(embeddings)} x {embeddings.shape[1]} embeddings, {args.clusters} clusters")
+    print(f"{'backend':<10} {'fit s':>8} {'predict s':>10} {'sizes':>13} {'silhouette':>11} {'DB index':>9}")
+    for backend in args.backends:
+        clustering = Clustering(args.clusters, backend, sample_size=args.sample_size).fit(embeddings)
+        start = time.perf_counter()
+        labels = clustering.predict(embeddings)
+        predict_seconds = time.perf_counter() - start
+        report = cluster_quality(embeddings, labels)
+        sizes = f"{report['min_size']}-{report['max_size']}"
+        print(f"{backend:<10} {clustering.fit_seconds:>8.2f} {predict_seconds:>10.2f} {sizes:>13} "
+              f"{report.get('silhouette', float('nan')):>11.3f} {report.get('davies_bouldin', float('nan')):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Compare embedding storage dtypes: size, load time and neighbor recall.
+
+Each dtype's dequantized rows are used as locked-image queries against the
+FAISS index and compared with the neighbors found from float32 rows.
+
+Reads the bundle data/bundles/CURRENT points to (legacy flat files in
+data/ if there is none); --data-dir picks another bundle or data directory.
+
+    python -m benchmarks.embedding_store --queries 500 --k 100
+    python -m benchmarks.embedding_store --data-dir data/bundles/<version>
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from benchmarks import current_data_dir, recall_at_k
+from embedding_store import EmbeddingStore, FILES, save_embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", help="Bundle or legacy data directory (default: the current bundle)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.data_dir = args.data_dir or current_data_dir()
+
+    index = faiss.read_index(os.path.join(args.data_dir, "faiss_index.bin"))
+    embeddings = np.load(os.path.join(args.data_dir, "embeddings.npy"), mmap_mode="r")
+    rng = np.random.default_rng(args.seed)
+    rows = np.sort(rng.choice(len(embeddings), min(args.queries, len(embeddings)), replace=False))
+    _, reference = index.search(np.ascontiguousarray(embeddings[rows], dtype=np.float32), args.k)
+
+    print(f"{len(embeddings)} x {embeddings.shape[1]} embeddings, {len(rows)} queries, k={args.k}")
+    print(f"{'dtype':<8} {'size MB':>9} {'mmap load ms':>13} {'full load ms':>13} {'recall@k':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype in FILES:
+            save_embeddings(embeddings, tmp, dtype)
+            timings = {}
+            for mmap in (True, False):
+                start = time.perf_counter()
+                store = EmbeddingStore.load(tmp, dtype=dtype, mmap=mmap)
+                store.get(rows[:1])
+                timings[mmap] = (time.perf_counter() - start) * 1000
+            _, candidate = index.search(store.get(rows), args.k)
+            print(f"{dtype:<8} {store.nbytes / 2**20:>9.1f} {timings[True]:>13.1f} "
+                  f"{timings[False]:>13.1f} {recall_at_k(reference, candidate):>9.4f}")
+            del store
+
+    start = time.perf_counter()
+    store = EmbeddingStore.load(args.data_dir, dtype="index", index=index)
+    _, candidate = index.search(store.get(rows), args.k)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"{'index':<8} {0.0:>9.1f} {'-':>13} {'-':>13} {recall_at_k(reference, candidate):>9.4f}"
+          f"  (reconstruct + search {elapsed:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
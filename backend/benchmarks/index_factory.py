@@ -0,0 +1,77 @@
+"""Compare FAISS index types on the real embeddings.
+
+Reports build time, serialized size, recall@k against exact search and
+p50/p99 single-query latency for each factory string.
+
+Reads embeddings.npy of the bundle data/bundles/CURRENT points to (or the
+legacy data/embeddings.npy); --embeddings picks another file.
+
+    python -m benchmarks.index_factory --k 100 "HNSW32" "IVF1024,Flat" "OPQ64,IVF1024,PQ64"
+    python -m benchmarks.index_factory --embeddings data/bundles/<version>/embeddings.npy
+"""
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+
+from benchmarks import current_data_dir, recall_at_k
+from models.indexing import apply_search_params, build_index, default_search_params
+
+
+def default_factories(n):
+    nlist = max(16, int(4 * np.sqrt(n)))
+    return ["Flat", "HNSW32", f"IVF{nlist},Flat", f"IVF{nlist},PQ64", f"OPQ64,IVF{nlist},PQ64"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("factories", nargs="*", help="FAISS factory strings (default: one of each family)")
+    parser.add_argument("--embeddings", help="Embeddings .npy file (default: the current bundle's)")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--search-params", default=None,
+                        help='Override query-time parameters, e.g. "nprobe=32" (default: per index family)')
+    parser.add_argument("--threads", type=int, default=None, help="OpenMP threads for FAISS")
+    args = parser.parse_args()
+    args.embeddings = args.embeddings or os.path.join(current_data_dir(), "embeddings.npy")
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+    embeddings = np.load(args.embeddings, mmap_mode="r")
+    rng = np.random.default_rng(0)
+    rows = np.sort(rng.choice(len(embeddings), min(args.queries, len(embeddings)), replace=False))
+    queries = np.array(embeddings[rows], dtype=np.float32)
+    faiss.normalize_L2(queries)
+    factories = args.factories or default_factories(len(embeddings))
+
+    print(f"{len(embeddings)} x {embeddings.shape[1]} embeddings, {len(rows)} queries, k={args.k}")
+    print(f"{'factory':<26} {'params':<14} {'build s':>8} {'size MB':>8} "
+          f"{'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    reference = None
+    for factory in ["Flat"] + [f for f in factories if f != "Flat"]:
+        start = time.perf_counter()
+        index = build_index(embeddings, factory)
+        build_seconds = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 2**20
+        params = args.search_params if args.search_params is not None else default_search_params(index)
+        apply_search_params(index, params)
+
+        _, found = index.search(queries, args.k)
+        if reference is None:
+            reference = found
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query[None, :], args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        p50, p99 = np.percentile(latencies, [50, 99])
+        if factory == "Flat" and "Flat" not in factories:
+            continue
+        print(f"{factory:<26} {params or '-':<14} {build_seconds:>8.2f} {size_mb:>8.1f} "
+              f"{recall_at_k(reference, found):>9.4f} {p50:>8.3f} {p99:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
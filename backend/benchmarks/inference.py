@@ -0,0 +1,60 @@
+"""Compare CPU inference backends for DINOv2 and the CLIP image encoder.
+
+For every backend and intra-op thread count, reports images/sec of each
+encoder and its agreement with fp32 eager: cosine similarity and, for
+CLIP, top-3 tag overlap. Pick INFERENCE_BACKEND and TORCH_THREADS in
+generate_all.py from the fastest accepted row. Loads the real models, so
+the first run downloads them.
+
+    python -m benchmarks.inference --images data/images --threads 4 8 --backends eager int8 onnx compile
+"""
+import argparse
+import os
+
+import torch
+from transformers import CLIPModel, CLIPProcessor
+
+from models.inference import BACKENDS, CHECK_IMAGES, accelerate, configure_threads, throughput
+from models.preprocess import SharedImageDataset, collate_shared
+from models.tagging import ClipImageEncoder, TagEngine
+from tags import TAGS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", default="data/images", help="Directory of sample images")
+    parser.add_argument("--count", type=int, default=CHECK_IMAGES, help="Images in the benchmark batch")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--threads", nargs="+", type=int, default=[torch.get_num_threads()])
+    parser.add_argument("--onnx-dir", default="data/onnx")
+    args = parser.parse_args()
+
+    configure_threads(inter_op=1)
+    paths = sorted(os.path.join(args.images, f) for f in os.listdir(args.images)
+                   if f.lower().endswith((".png", ".jpg", ".jpeg")))[:args.count]
+    dataset = SharedImageDataset(paths)
+    dino_batch, clip_batch, paths, _ = collate_shared([dataset[i] for i in range(len(dataset))])
+    if not paths:
+        raise SystemExit(f"No readable images in {args.images}")
+
+    clip = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+    engine = TagEngine(clip, CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32"), TAGS)
+    dinov2 = torch.hub.load("facebookresearch/dinov2", "dinov2_vitb14").eval()
+
+    print(f"{len(paths)} images")
+    print(f"{'backend':<9} {'threads':>7}  {'dinov2 img/s':>12} {'cosine':>7}  {'clip img/s':>10} {'cosine':>7} "
+          f"{'tags':>6}  accepted")
+    for backend in args.backends:
+        for threads in args.threads:
+            configure_threads(threads)  # Before building, so ONNX Runtime sessions pick up the count
+            dino_encoder, dino_report = accelerate(dinov2, backend, dino_batch, "dinov2", onnx_dir=args.onnx_dir)
+            clip_encoder, clip_report = accelerate(ClipImageEncoder(clip), backend, clip_batch, "clip",
+                                                   text_embeddings=engine.text_embeddings, onnx_dir=args.onnx_dir)
+            print(f"{backend:<9} {threads:>7}  {throughput(dino_encoder, dino_batch):>12.1f} "
+                  f"{dino_report.get('cosine_mean', 1.0):>7.4f}  {throughput(clip_encoder, clip_batch):>10.1f} "
+                  f"{clip_report.get('cosine_mean', 1.0):>7.4f} {clip_report.get('tag_agreement', 1.0):>6.3f}  "
+                  f"{dino_report['accepted'] and clip_report['accepted']}")
+
+
+if __name__ == "__main__":
+    main()
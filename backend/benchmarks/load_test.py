@@ -0,0 +1,82 @@
+"""Check that /api/search latency stays flat while moodboards are rendering.
+
+Runs a search-only phase, then the same search load alongside a number of
+clients looping on /api/save, and prints p50/p99 search latency, throughput
+and how many requests were shed with 429 in each phase. Start the server
+first, e.g. ``uvicorn app:app --workers 1``.
+
+    python -m benchmarks.load_test --url http://localhost:8000 --duration 20 --save-clients 8
+"""
+import argparse
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+
+def hammer(url, stop, latencies, statuses):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = 0
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses.append(status)
+
+
+def run_phase(search_url, save_url, search_clients, save_clients, duration):
+    stop = threading.Event()
+    search_latencies, search_statuses = [], []
+    save_latencies, save_statuses = [], []
+    threads = [threading.Thread(target=hammer, args=(search_url, stop, search_latencies, search_statuses))
+               for _ in range(search_clients)]
+    threads += [threading.Thread(target=hammer, args=(save_url, stop, save_latencies, save_statuses))
+                for _ in range(save_clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return search_latencies, search_statuses, save_latencies, save_statuses
+
+
+def summarize(label, latencies, statuses, duration):
+    if not latencies:
+        print(f"{label:<22} no requests")
+        return
+    ok = [lat for lat, status in zip(latencies, statuses) if status == 200]
+    p50, p99 = np.percentile(ok, [50, 99]) if ok else (float("nan"), float("nan"))
+    print(f"{label:<22} {len(ok) / duration:>8.1f} req/s  p50 {p50:>8.1f} ms  p99 {p99:>8.1f} ms  "
+          f"429s {statuses.count(429):>5}  errors {sum(s not in (200, 429) for s in statuses):>4}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--query", default="poster design,logomark")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per phase")
+    parser.add_argument("--search-clients", type=int, default=8)
+    parser.add_argument("--save-clients", type=int, default=8)
+    args = parser.parse_args()
+
+    search_url = f"{args.url}/api/search?" + urllib.parse.urlencode({"query": args.query, "count": 12})
+    save_url = f"{args.url}/api/save"
+
+    baseline = run_phase(search_url, save_url, args.search_clients, 0, args.duration)
+    loaded = run_phase(search_url, save_url, args.search_clients, args.save_clients, args.duration)
+    summarize("search (baseline)", baseline[0], baseline[1], args.duration)
+    summarize("search (under /save)", loaded[0], loaded[1], args.duration)
+    summarize("save", loaded[2], loaded[3], args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Throughput and latency percentiles of the serving endpoints on a synthetic corpus.
+
+Runs a fixed mix of scenarios (default feed, tag queries, lock, locked
+search, batch search, moodboard save) against the corpus under --root,
+either in-process through Starlette's TestClient (default; app.py is
+imported from --root) or over HTTP against a running server (--url).
+Every scenario issues --requests requests from --clients threads, and the
+report has req/s with p50/p95/p99 latency. With --json the results are also
+written to a file, so runs before and after a change can be compared.
+
+    python -m benchmarks.synthetic_corpus --size 200k --out /tmp/moodboard-200k
+    python -m benchmarks.serving --root /tmp/moodboard-200k
+    (cd /tmp/moodboard-200k && uvicorn app:app --app-dir "$OLDPWD")  # then:
+    python -m benchmarks.serving --root /tmp/moodboard-200k --url http://localhost:8000
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+import bundle
+
+
+class HttpClient:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def request(self, method, path, params=None, body=None):
+        url = self.url + path + ("?" + urllib.parse.urlencode(params) if params else "")
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(url, data=data, method=method,
+                                         headers={"Content-Type": "application/json"} if data else {})
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except OSError:
+            return 0
+
+
+class InProcessClient:
+    """Calls the app through one TestClient shared by all threads.
+
+    Entering the client starts a single event loop for the app, as uvicorn
+    would; per-thread clients would each run their own loop, which the
+    endpoint limiters' asyncio semaphores do not support.
+    """
+
+    def __init__(self, app):
+        from fastapi.testclient import TestClient
+        self.client = TestClient(app)
+
+    def __enter__(self):
+        self.client.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.client.__exit__(*exc)
+
+    def request(self, method, path, params=None, body=None):
+        return self.client.request(method, path, params=params, json=body).status_code
+
+
+def scenarios(metadata, rng, batch_size):
+    """name -> (weight in --requests, fn(client, session) issuing one request and returning its status)."""
+    rows = len(metadata)
+
+    def random_path():
+        return metadata.paths[rng.randrange(rows)]
+
+    def tags(n):
+        return ",".join(rng.sample(metadata.tags, n))
+
+    def lock(client, session):
+        return client.request("POST", "/api/lock", body={"image_path": random_path(), "session_id": session})
+
+    def search_locked(client, session):
+        return client.request("GET", "/api/search", {"query": "", "session_id": session})
+
+    def batch(client, session):
+        queries = [{"id": str(i), "image_path": random_path()} for i in range(batch_size)]
+        return client.request("POST", "/api/search/batch", body={"queries": queries})
+
+    return {
+        "search default": (1.0, lambda client, session: client.request("GET", "/api/search", {"query": ""})),
+        "search 1 tag": (1.0, lambda client, session: client.request("GET", "/api/search", {"query": tags(1)})),
+        "search 2 tags (and)": (1.0, lambda client, session: client.request(
+            "GET", "/api/search", {"query": tags(2), "mode": "and", "facets": "true"})),
+        "lock": (1.0, lock),
+        "search locked": (1.0, search_locked),  # Sessions stay locked from the "lock" scenario
+        f"search batch x{batch_size}": (0.1, batch),
+        "save": (0.1, lambda client, session: client.request("GET", "/api/save", {"session_id": session})),
+    }
+
+
+def run(make_client, fn, requests, clients):
+    latencies, statuses = [], []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker(i):
+        client = make_client()
+        session = f"bench-{i}"
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            start = time.perf_counter()
+            status = fn(client, session)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses.append(status)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def summarize(name, latencies, statuses, seconds, out=None):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (float("nan"),) * 3
+    errors = sum(status != 200 for status in statuses)
+    print(f"{name:<22} {len(latencies) / seconds:>8.1f} req/s  p50 {p50:>7.1f} ms  p95 {p95:>7.1f} ms  "
+          f"p99 {p99:>7.1f} ms  errors {errors:>4}", file=out, flush=True)
+    return {"requests": len(latencies), "seconds": seconds, "rps": len(latencies) / seconds,
+            "p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "errors": errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", required=True, help="Directory holding data/ (see benchmarks.synthetic_corpus)")
+    parser.add_argument("--url", help="Benchmark a running server over HTTP instead of in-process")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario (weighted)")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--only", nargs="*", help="Run only these scenarios")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    json_path = os.path.abspath(args.json) if args.json else None
+    directory = bundle.current(os.path.join(root, "data"))
+    if directory is None:
+        raise SystemExit(f"No published bundle under {root}/data")
+    manifest = bundle.load_manifest(directory)
+    metadata = bundle.BundleMetadata(directory, manifest["tags"])
+    print(f"Corpus {manifest['version']}: {manifest['rows']} rows, index {manifest.get('index_factory')}")
+
+    out = sys.stdout  # Kept for the report while the app's own prints are silenced
+    stack = contextlib.ExitStack()
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+    else:
+        os.environ.setdefault("MOODBOARD_RELOAD_INTERVAL", "0")
+        os.environ.setdefault("MOODBOARD_UPLOAD_SEARCH", "off")  # The scenarios don't upload; skip loading DINOv2
+        os.chdir(root)  # app.py reads data/ relative to the working directory
+        start = time.perf_counter()
+        import app
+        print(f"In-process app loaded in {time.perf_counter() - start:.2f} s "
+              f"(neighbor source: {app.reloader.current.neighbor_source})")
+        client = stack.enter_context(InProcessClient(app.app))
+        make_client = lambda: client
+        stack.enter_context(contextlib.redirect_stdout(open(os.devnull, "w")))  # app.py prints every search query
+
+    results = {"corpus": manifest["version"], "rows": manifest["rows"], "mode": args.url or "in-process",
+               "clients": args.clients, "scenarios": {}}
+    with stack:
+        for name, (weight, fn) in scenarios(metadata, random.Random(args.seed), args.batch_size).items():
+            if args.only and name not in args.only:
+                continue
+            latencies, statuses, seconds = run(make_client, fn, max(1, int(args.requests * weight)), args.clients)
+            results["scenarios"][name] = summarize(name, latencies, statuses, seconds, out)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Build a model-free synthetic corpus that the server can load like a real one.
+
+Writes <out>/data/bundles/<version> (published, so data/bundles/CURRENT
+points at it) plus placeholder images under <out>/data/images, with the
+same files generate_all.py produces: clustered unit-vector embeddings, a
+FAISS index, cluster labels, tag metadata drawn from TAGS and float16 tag
+probabilities. No CLIP index or k-NN graph is written. Everything is
+derived from --seed, so the same size and seed give the same corpus.
+Run the server or benchmarks.serving from <out>.
+
+    python -m benchmarks.synthetic_corpus --size 200k --out /tmp/moodboard-200k
+    python -m benchmarks.synthetic_corpus --size 2m --out /tmp/moodboard-2m --index HNSW32
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import time
+
+import faiss
+import numpy as np
+from PIL import Image
+
+import bundle
+from models.indexing import build_index
+from tag_scores import NAMES_FILE, PROBS_FILE
+from tags import TAGS
+
+SIZES = {"20k": 20_000, "200k": 200_000, "2m": 2_000_000}
+DIM = 768  # DINOv2 ViT-B/14 embedding width
+CHUNK = 100_000  # Rows generated per step, so 2M x 768 never sits in memory twice
+PALETTE = 64  # Distinct placeholder images; every row's file is a hard link to one of them
+IMAGE_SIZE = 256
+DIR_ROWS = 10_000  # Image files per directory
+
+
+def image_path(row):
+    return f"./data/images/synthetic/{row // DIR_ROWS:04d}/{row}.jpg"
+
+
+def write_embeddings(path, rows, dim, n_clusters, rng, noise=0.6):
+    """Clustered unit vectors (Gaussian blobs around random centers); returns the cluster of each row."""
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    labels = rng.integers(n_clusters, size=rows).astype(np.int32)
+    embeddings = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(rows, dim))
+    for start in range(0, rows, CHUNK):
+        stop = min(start + CHUNK, rows)
+        chunk = centers[labels[start:stop]] + rng.standard_normal((stop - start, dim), dtype=np.float32) * (
+            noise / np.sqrt(dim))
+        chunk /= np.linalg.norm(chunk, axis=1, keepdims=True)
+        embeddings[start:stop] = chunk
+    embeddings.flush()
+    return embeddings, labels
+
+
+def write_tags(bundle_dir, labels, n_clusters, rng, threshold=0.2):
+    """Tag probabilities where each cluster favours a few tags; metadata tags are those above threshold.
+
+    Returns the tags of every row, as generate_all.py derives them from CLIP.
+    """
+    rows, n_tags = len(labels), len(TAGS)
+    favoured = np.stack([rng.choice(n_tags, 6, replace=False) for _ in range(n_clusters)])
+    probs = np.lib.format.open_memmap(os.path.join(bundle_dir, PROBS_FILE), mode="w+", dtype=np.float16,
+                                      shape=(n_tags, rows))  # Tag-major, as save_tag_probs writes it
+    row_tags = []
+    for start in range(0, rows, CHUNK):
+        stop = min(start + CHUNK, rows)
+        chunk = rng.beta(0.5, 20.0, size=(stop - start, n_tags)).astype(np.float32)
+        # One to three of the cluster's favoured tags score high on every row
+        picks = favoured[labels[start:stop]][:, :3]
+        keep = rng.random(picks.shape) < np.array([1.0, 0.7, 0.4])
+        boost = rng.uniform(0.25, 0.9, size=picks.shape).astype(np.float32)
+        at = np.arange(len(chunk))[:, None]
+        chunk[at, picks] = np.where(keep, boost, chunk[at, picks])
+        probs[:, start:stop] = chunk.T
+        row_tags.extend([TAGS[j] for j in np.flatnonzero(row > threshold)] for row in chunk)
+    probs.flush()
+    with open(os.path.join(bundle_dir, NAMES_FILE), "w") as f:
+        json.dump(TAGS, f)
+    return row_tags
+
+
+def write_images(data_dir, rows, rng):
+    """Placeholder JPEGs for every row, hard-linked to PALETTE encoded images (copied if links fail)."""
+    palette_dir = os.path.join(data_dir, "images", "palette")
+    os.makedirs(palette_dir, exist_ok=True)
+    sources = []
+    for i in range(PALETTE):
+        color = rng.integers(0, 256, size=3)
+        gradient = np.linspace(0.6, 1.0, IMAGE_SIZE, dtype=np.float32)[:, None, None]
+        pixels = (np.broadcast_to(color, (IMAGE_SIZE, IMAGE_SIZE, 3)) * gradient).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=80)
+        sources.append(os.path.join(palette_dir, f"{i}.jpg"))
+        with open(sources[-1], "wb") as f:
+            f.write(buffer.getvalue())
+    link = os.link
+    for row in range(rows):
+        path = os.path.join(os.path.dirname(data_dir), image_path(row))
+        if row % DIR_ROWS == 0:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            continue
+        try:
+            link(sources[row % PALETTE], path)
+        except OSError:
+            link = shutil.copyfile
+            link(sources[row % PALETTE], path)
+
+
+def build(out, rows, dim=DIM, n_clusters=None, factory="Flat", images=True, seed=0):
+    """Write and publish a synthetic corpus under out/data; returns (bundle directory, seconds per step)."""
+    rng = np.random.default_rng(seed)
+    n_clusters = n_clusters or max(20, int(np.sqrt(rows) / 4))
+    data_dir = os.path.join(out, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    bundle_dir = bundle.staging_dir(data_dir)
+    timings = {}
+
+    start = time.perf_counter()
+    embeddings, labels = write_embeddings(os.path.join(bundle_dir, "embeddings.npy"), rows, dim, n_clusters, rng)
+    np.save(os.path.join(bundle_dir, "cluster_labels.npy"), labels)
+    timings["embeddings"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    row_tags = write_tags(bundle_dir, labels, n_clusters, rng)
+    tags = bundle.write_metadata(bundle_dir, [{"path": image_path(row), "tags": t} for row, t in enumerate(row_tags)],
+                                 TAGS)
+    del row_tags
+    timings["metadata"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    faiss.write_index(build_index(embeddings, factory), os.path.join(bundle_dir, "faiss_index.bin"))
+    del embeddings
+    timings["index"] = time.perf_counter() - start
+
+    if images:
+        start = time.perf_counter()
+        write_images(data_dir, rows, rng)
+        timings["images"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bundle_dir = bundle.publish(bundle_dir, tags, keep=1, index_factory=factory, embedding_dtype="float32",
+                                synthetic={"rows": rows, "dim": dim, "clusters": n_clusters, "seed": seed})
+    timings["publish"] = time.perf_counter() - start
+    return bundle_dir, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=SIZES, default="20k")
+    parser.add_argument("--rows", type=int, help="Exact row count, overriding --size")
+    parser.add_argument("--out", required=True, help="Server root; the corpus goes to <out>/data")
+    parser.add_argument("--dim", type=int, default=DIM)
+    parser.add_argument("--clusters", type=int, help="Default: sqrt(rows) / 4, at least 20")
+    parser.add_argument("--index", default="Flat", help="FAISS factory string, e.g. HNSW32 or IVF4096,Flat")
+    parser.add_argument("--no-images", action="store_true", help="Skip placeholder images (/api/save then renders blanks)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = args.rows or SIZES[args.size]
+    bundle_dir, timings = build(args.out, rows, args.dim, args.clusters, args.index, not args.no_images, args.seed)
+    print(f"Published {bundle_dir}: {rows} rows, dim {args.dim}, index {args.index}")
+    for step, seconds in timings.items():
+        print(f"  {step:<12} {seconds:>8.1f} s")
+
+
+if __name__ == "__main__":
+    main()
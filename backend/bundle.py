@@ -0,0 +1,231 @@
+import json
+import os
+import shutil
+import time
+
+import faiss
+import numpy as np
+
+from id_index import path_hash
+from models.manifest import file_hash
+
+# One generation of generate_all.py output lives in data/bundles/<version>/,
+# and data/bundles/CURRENT names the one to serve. A bundle is written under
+# <version>.partial and only renamed into place once bundle.json (row count
+# plus size and checksum of every file) is complete, so readers never see a
+# half-written generation.
+BUNDLES_DIR = "bundles"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "bundle.json"
+FORMAT = 1
+KEEP = 3  # Generations kept on disk, including the current one
+
+# Columnar metadata: a UTF-8 path table, hashed path lookup, and tags coded
+# as small ints in both directions (row -> tags and tag -> rows)
+PATHS_DATA, PATHS_OFFSETS = "paths_data.npy", "paths_offsets.npy"
+PATH_HASHES, PATH_HASH_ROWS = "path_hashes.npy", "path_hash_rows.npy"
+TAG_PTR, TAG_IDS = "tag_ptr.npy", "tag_ids.npy"
+POSTINGS_PTR, POSTINGS = "postings_ptr.npy", "postings.npy"
+
+# Per-row artifacts that must line up with the metadata rows
+ROW_ARRAYS = ("embeddings.npy", "embeddings_f16.npy", "embeddings_i8.npy", "embeddings_i8_scales.npy",
+              "clip_embeddings.npy", "cluster_labels.npy", "knn_indices.npy", "knn_distances.npy",
+              "tile_atlas.npy", "tile_atlas_failed.npy", PATH_HASHES, PATH_HASH_ROWS)
+COLUMN_ARRAYS = ("tag_probs.npy",)  # Tag-major: rows along the second axis
+ROW_INDEXES = ("faiss_index.bin", "clip_index.bin")
+
+
+def current(data_dir):
+    """Path of the bundle being served from data_dir, or None if there is none."""
+    pointer = os.path.join(data_dir, BUNDLES_DIR, CURRENT_FILE)
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer, "r") as f:
+        path = os.path.join(data_dir, BUNDLES_DIR, f.read().strip())
+    return path if os.path.exists(os.path.join(path, MANIFEST_FILE)) else None
+
+
+def staging_dir(data_dir):
+    """Create an empty directory for the next generation and return it.
+
+    Leftover <version>.partial directories of failed runs are deleted first;
+    runs against one data directory are assumed not to overlap.
+    """
+    root = os.path.join(data_dir, BUNDLES_DIR)
+    if os.path.isdir(root):
+        for name in os.listdir(root):
+            if name.endswith(".partial"):
+                print(f"Removing staging directory of an unfinished run: {name}")
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    version = time.strftime("%Y%m%d-%H%M%S")
+    suffix = 0
+    while os.path.exists(os.path.join(root, version)) or os.path.exists(os.path.join(root, version + ".partial")):
+        suffix += 1
+        version = f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+    path = os.path.join(root, version + ".partial")
+    os.makedirs(path)
+    return path
+
+
+def write_metadata(bundle_dir, metadata, tag_names=()):
+    """Write metadata ({"path", "tags"} per row) as columnar arrays; returns the tag vocabulary."""
+    tags = list(dict.fromkeys([*tag_names, *(tag for meta in metadata for tag in meta["tags"])]))
+    tag_ids = {tag: i for i, tag in enumerate(tags)}
+
+    encoded = [meta["path"].encode("utf-8") for meta in metadata]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(bundle_dir, PATHS_DATA), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(bundle_dir, PATHS_OFFSETS), offsets)
+
+    hashes = np.array([path_hash(meta["path"]) for meta in metadata], dtype=np.uint64)
+    order = np.argsort(hashes, kind="stable")
+    np.save(os.path.join(bundle_dir, PATH_HASHES), hashes[order])
+    np.save(os.path.join(bundle_dir, PATH_HASH_ROWS), order.astype(np.int32))
+
+    tag_ptr = np.zeros(len(metadata) + 1, dtype=np.int64)
+    np.cumsum([len(meta["tags"]) for meta in metadata], out=tag_ptr[1:])
+    row_tags = np.fromiter((tag_ids[tag] for meta in metadata for tag in meta["tags"]),
+                           dtype=np.int16, count=int(tag_ptr[-1]))
+    np.save(os.path.join(bundle_dir, TAG_PTR), tag_ptr)
+    np.save(os.path.join(bundle_dir, TAG_IDS), row_tags)
+
+    rows = np.repeat(np.arange(len(metadata), dtype=np.int32), np.diff(tag_ptr))
+    by_tag = np.argsort(row_tags, kind="stable")  # Stable, so each posting list stays sorted
+    postings_ptr = np.zeros(len(tags) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_tags, minlength=len(tags)), out=postings_ptr[1:])
+    np.save(os.path.join(bundle_dir, POSTINGS_PTR), postings_ptr)
+    np.save(os.path.join(bundle_dir, POSTINGS), rows[by_tag])
+    return tags
+
+
+def _row_counts(bundle_dir):
+    """Yield (file, rows) for every row-aligned artifact present in bundle_dir."""
+    for name in ROW_ARRAYS + COLUMN_ARRAYS:
+        path = os.path.join(bundle_dir, name)
+        if os.path.exists(path):
+            shape = np.load(path, mmap_mode="r").shape
+            yield name, shape[1] if name in COLUMN_ARRAYS else shape[0]
+    for name in ROW_INDEXES:
+        path = os.path.join(bundle_dir, name)
+        if os.path.exists(path):
+            yield name, faiss.read_index(path, faiss.IO_FLAG_MMAP).ntotal
+    yield PATHS_OFFSETS, len(np.load(os.path.join(bundle_dir, PATHS_OFFSETS), mmap_mode="r")) - 1
+    yield TAG_PTR, len(np.load(os.path.join(bundle_dir, TAG_PTR), mmap_mode="r")) - 1
+
+
+def check_rows(bundle_dir, rows):
+    """Raise ValueError unless every artifact in bundle_dir has exactly rows rows."""
+    misaligned = {name: n for name, n in _row_counts(bundle_dir) if n != rows}
+    if misaligned:
+        raise ValueError(f"{bundle_dir}: artifacts do not line up with {rows} metadata rows: {misaligned}")
+
+
+def publish(bundle_dir, tags, keep=KEEP, **info):
+    """Validate, checksum and atomically make a staged bundle the current one.
+
+    Extra keyword arguments are recorded in bundle.json (e.g. index factory).
+    Returns the final bundle directory.
+    """
+    rows = len(np.load(os.path.join(bundle_dir, PATHS_OFFSETS), mmap_mode="r")) - 1
+    check_rows(bundle_dir, rows)
+    root = os.path.dirname(bundle_dir)
+    version = os.path.basename(bundle_dir)[:-len(".partial")]
+    files = {}
+    for name in sorted(os.listdir(bundle_dir)):
+        path = os.path.join(bundle_dir, name)
+        files[name] = {"bytes": os.path.getsize(path), "blake2b": file_hash(path)}
+    manifest = {"format": FORMAT, "version": version, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "rows": rows, "tags": list(tags), "files": files, **info}
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    final = os.path.join(root, version)
+    os.rename(bundle_dir, final)
+    tmp = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+    finished = sorted(name for name in os.listdir(root)
+                      if os.path.exists(os.path.join(root, name, MANIFEST_FILE)))
+    for name in finished[:-keep] if keep else []:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return final
+
+
+def load_manifest(bundle_dir):
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), "r") as f:
+        return json.load(f)
+
+
+def verify(bundle_dir, checksums=True):
+    """Check that every file listed in bundle.json is present with the recorded size
+    (and, with checksums=True, content). Returns the manifest; raises ValueError."""
+    manifest = load_manifest(bundle_dir)
+    if manifest.get("format") != FORMAT:
+        raise ValueError(f"{bundle_dir}: unsupported bundle format {manifest.get('format')!r}")
+    for name, expected in manifest["files"].items():
+        path = os.path.join(bundle_dir, name)
+        if not os.path.exists(path) or os.path.getsize(path) != expected["bytes"]:
+            raise ValueError(f"{bundle_dir}: {name} is missing or has the wrong size")
+        if checksums and file_hash(path) != expected["blake2b"]:
+            raise ValueError(f"{bundle_dir}: checksum mismatch for {name}")
+    return manifest
+
+
+class StringTable:
+    """Read-only sequence of strings stored as one UTF-8 byte array plus offsets."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class BundleMetadata:
+    """Memory-mapped, columnar stand-in for the list of metadata dicts.
+
+    metadata[row] still returns {"path": ..., "tags": [...]}, built on demand,
+    so code written against metadata.json keeps working.
+    """
+
+    def __init__(self, bundle_dir, tags):
+        def load(name):
+            return np.load(os.path.join(bundle_dir, name), mmap_mode="r")
+
+        self.tags = list(tags)
+        self.paths = StringTable(load(PATHS_DATA), load(PATHS_OFFSETS))
+        self.path_hashes, self.path_hash_rows = load(PATH_HASHES), load(PATH_HASH_ROWS)
+        self.tag_ptr, self.tag_ids = load(TAG_PTR), load(TAG_IDS)
+        self.postings_ptr, self.postings = load(POSTINGS_PTR), load(POSTINGS)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, row):
+        return {"path": self.paths[row], "tags": self.row_tags(row)}
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    def row_tags(self, row):
+        return [self.tags[i] for i in self.tag_ids[self.tag_ptr[row]:self.tag_ptr[row + 1]]]
+
+
+def read_metadata(data_dir):
+    """Metadata of a bundle directory, or of a legacy flat directory (metadata.json)."""
+    if os.path.exists(os.path.join(data_dir, MANIFEST_FILE)):
+        return BundleMetadata(data_dir, load_manifest(data_dir)["tags"])
+    with open(os.path.join(data_dir, "metadata.json"), "r") as f:
+        return json.load(f)
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+
+LABELS_FILE = "cluster_labels.npy"
+
+
+def _normalized(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class ClusterIndex:
+    """Metadata rows grouped by the cluster labels written by generate_all.py.
+
+    Rows are stored cluster by cluster (CSR style), so drawing a random member
+    of a cluster or gathering a few clusters' rows never scans the corpus.
+    Centroids are only needed for coarse search and are fitted on demand.
+    """
+
+    def __init__(self, labels):
+        labels = np.asarray(labels)
+        self.n_rows = len(labels)
+        self.cluster_ids, positions, counts = np.unique(labels, return_inverse=True, return_counts=True)
+        self.order = np.argsort(positions, kind="stable").astype(np.int32)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.centroids = None
+
+    @classmethod
+    def load(cls, data_dir, expected_rows=None):
+        """Load the cluster labels, or return None if they are absent or stale."""
+        path = os.path.join(data_dir, LABELS_FILE)
+        if not os.path.exists(path):
+            return None
+        labels = np.load(path)
+        if expected_rows is not None and len(labels) != expected_rows:
+            print(f"Ignoring stale cluster labels ({len(labels)} rows, expected {expected_rows})")
+            return None
+        return cls(labels)
+
+    def __len__(self):
+        return len(self.cluster_ids)
+
+    def members(self, cluster):
+        """Rows of the cluster at position cluster (0..len-1)."""
+        return self.order[self.offsets[cluster]:self.offsets[cluster + 1]]
+
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    def fit_centroids(self, store, chunk_size=65_536):
+        """Mean direction of each cluster's normalized embeddings (from an EmbeddingStore)."""
+        centroids = np.zeros((len(self), store.dim), dtype=np.float32)
+        for cluster in range(len(self)):
+            rows = self.members(cluster)
+            for start in range(0, len(rows), chunk_size):
+                centroids[cluster] += _normalized(store.get(rows[start:start + chunk_size])).sum(axis=0)
+        self.centroids = _normalized(centroids)
+        return self.centroids
+
+    def search(self, store, query, k, nprobe=4):
+        """Exact top-k rows (by cosine) within the nprobe clusters nearest to query.
+
+        The IVF idea with the serving-time clusters as coarse cells: only the
+        probed clusters' rows are read and scored.
+        """
+        if self.centroids is None:
+            raise RuntimeError("fit_centroids() must be called before search()")
+        query = _normalized(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        nprobe = min(nprobe, len(self))
+        probed = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.sort(np.concatenate([self.members(c) for c in probed]))  # Sorted reads are kinder to a memmap
+        scores = _normalized(store.get(rows)) @ query
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return rows[top[np.argsort(-scores[top])]]
+
+    def sample(self, count, rng=None):
+        """Draw up to count distinct rows spread evenly across clusters.
+
+        Clusters are visited round-robin in random order and a random member
+        is taken from each, so the cost is O(count) whatever the corpus size.
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        count = min(count, self.n_rows)
+        if count <= 0:
+            return []
+        sizes = self.sizes()
+        clusters = rng.permutation(len(self))
+        picked, seen = [], set()
+        attempts = 0
+        while len(picked) < count and attempts < 4 * count + len(self):
+            cluster = clusters[attempts % len(clusters)]
+            attempts += 1
+            row = int(self.order[self.offsets[cluster] + rng.integers(sizes[cluster])])
+            if row not in seen:
+                seen.add(row)
+                picked.append(row)
+        return picked
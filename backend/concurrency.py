@@ -0,0 +1,72 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+
+class EndpointLimiter:
+    """Bounded executor plus admission control for one class of endpoint.
+
+    At most max_concurrent calls run on the limiter's own thread pool and at
+    most max_queue more may wait for a slot; anything beyond that is turned
+    away immediately with 429 so a burst of slow requests (e.g. moodboard
+    renders) cannot pile up and starve cheap ones (searches) on other pools.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue=0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix=name)
+        self._semaphore = None
+        self.in_flight = 0
+        self.rejected = 0
+
+    def _slots(self):
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool, or raise 429 when saturated."""
+        if self.in_flight >= self.max_concurrent + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail=f"{self.name} is busy, retry shortly",
+                                headers={"Retry-After": "1"})
+        self.in_flight += 1
+        slots = self._slots()
+        try:
+            await slots.acquire()
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        loop = asyncio.get_running_loop()
+        try:
+            future = self.executor.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._finished(slots)
+            raise
+        # The slot is freed when the work finishes, not when this coroutine exits: a
+        # request cancelled mid-call (client disconnect) keeps its worker busy until then
+        future.add_done_callback(lambda _: self._finish_from_thread(loop, slots))
+        return await asyncio.wrap_future(future)
+
+    def _finish_from_thread(self, loop, slots):
+        try:
+            loop.call_soon_threadsafe(self._finished, slots)
+        except RuntimeError:  # Event loop already closed (shutdown)
+            pass
+
+    def _finished(self, slots):
+        slots.release()
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,81 @@
+import os
+
+import faiss
+
+import bundle
+from cluster_index import ClusterIndex
+from embedding_store import EmbeddingStore
+from id_index import IdIndex
+from models.indexing import apply_search_params, default_search_params
+from models.knn_graph import load_knn_graph
+from moodboard import load_atlas, load_atlas_failures
+from tag_index import TagIndex
+from tag_scores import TagScores
+from text_search import TextSearch
+
+
+class Corpus:
+    """Everything served from one generation of generate_all.py output.
+
+    Loads the current bundle under data_dir (data/bundles/CURRENT) when there
+    is one, otherwise the legacy flat files in data_dir. Bundle arrays and the
+    FAISS index are memory-mapped, so loading mostly reads file headers.
+    Optional artifacts that are missing or do not match the row count are None.
+    """
+
+    def __init__(self, directory, version, metadata, index, embeddings, tag_index, id_index,
+                 tag_scores=None, cluster_index=None, text_search=None, knn_graph=None, atlas=None, atlas_failed=None):
+        self.directory = directory
+        self.version = version
+        self.metadata = metadata
+        self.index = index
+        self.embeddings = embeddings
+        self.tag_index = tag_index
+        self.id_index = id_index
+        self.tag_scores = tag_scores
+        self.cluster_index = cluster_index
+        self.text_search = text_search
+        self.knn_graph = knn_graph
+        self.atlas = atlas
+        self.atlas_failed = atlas_failed
+
+    @classmethod
+    def load(cls, data_dir="data", embedding_dtype="float32", search_params=None, verify=False,
+             text_search=True, knn_graph=True):
+        """Open a generation; verify=True also checks every bundle file's checksum."""
+        directory = bundle.current(data_dir)
+        if directory is not None:
+            manifest = bundle.verify(directory, checksums=verify)
+            version = manifest["version"]
+            metadata = bundle.BundleMetadata(directory, manifest["tags"])
+            tag_index, id_index = TagIndex.from_bundle(metadata), IdIndex.from_bundle(metadata)
+            index = faiss.read_index(os.path.join(directory, "faiss_index.bin"), faiss.IO_FLAG_MMAP)
+        else:
+            directory, version = data_dir, None
+            metadata = bundle.read_metadata(data_dir)
+            tag_index, id_index = TagIndex(metadata), IdIndex.from_metadata(metadata)
+            index = faiss.read_index(os.path.join(data_dir, "faiss_index.bin"))
+        rows = len(metadata)
+        if index.ntotal != rows:
+            raise ValueError(f"{directory}: FAISS index has {index.ntotal} vectors but metadata has {rows} rows")
+        # Query-time knobs such as "nprobe=32" or "efSearch=200"; defaults suit the index family
+        apply_search_params(index, search_params if search_params is not None else default_search_params(index))
+
+        graph = load_knn_graph(directory) if knn_graph else None
+        if graph is not None and len(graph) != rows:
+            print(f"Ignoring stale k-NN graph ({len(graph)} rows, expected {rows})")
+            graph = None
+        return cls(
+            directory, version, metadata, index,
+            EmbeddingStore.load(directory, dtype=embedding_dtype, index=index),
+            tag_index, id_index,
+            tag_scores=TagScores.load(directory, expected_rows=rows),
+            cluster_index=ClusterIndex.load(directory, expected_rows=rows),
+            text_search=TextSearch.load(directory, expected_rows=rows) if text_search else None,
+            knn_graph=graph,
+            atlas=load_atlas(directory, expected_rows=rows),
+            atlas_failed=load_atlas_failures(directory, expected_rows=rows),
+        )
+
+    def __len__(self):
+        return len(self.metadata)
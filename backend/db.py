@@ -0,0 +1,177 @@
+import random
+import sqlite3
+import threading
+
+# PRAGMA user_version of the metadata database:
+#   0  legacy: tags as a JSON array in images.tags (generate_all new.py before normalization)
+#   1  tags normalized into tags/image_tags
+SCHEMA_VERSION = 1
+BUSY_TIMEOUT_MS = 5000  # How long a writer waits for another connection's lock before failing
+SAMPLE_ATTEMPTS = 4     # Random rowid probes per requested row in random_paths()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    image_id TEXT PRIMARY KEY,
+    path TEXT UNIQUE,
+    cluster_label INTEGER
+);
+CREATE TABLE IF NOT EXISTS tags (
+    tag_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE COLLATE NOCASE
+);
+-- Keyed by (tag_id, image_id) so "images with tag t" is a range scan of the
+-- table itself, and the second index covers the per-image direction
+CREATE TABLE IF NOT EXISTS image_tags (
+    image_id TEXT NOT NULL REFERENCES images (image_id) ON DELETE CASCADE,
+    tag_id INTEGER NOT NULL REFERENCES tags (tag_id),
+    PRIMARY KEY (tag_id, image_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_image_tags_image ON image_tags (image_id, tag_id);
+"""
+
+
+def connect(path):
+    """Open the metadata database in WAL mode, so readers never block on the writer."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")  # Durable at checkpoints; safe against corruption in WAL mode
+    conn.execute("PRAGMA foreign_keys = ON")  # Deleting an image drops its image_tags rows
+    return conn
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def migrate(conn):
+    """Bring the schema to SCHEMA_VERSION; returns the version found before migrating.
+
+    A legacy database has its JSON tags copied into tags/image_tags, and the
+    JSON column and its index are dropped, in one transaction. Safe to call
+    from several connections at once: the first takes the write lock and the
+    others find the work done.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return version
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            legacy = "tags" in _columns(conn, "images")
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            if legacy:
+                _migrate_json_tags(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return version
+
+
+def _migrate_json_tags(conn):
+    conn.execute("""
+        INSERT OR IGNORE INTO tags (name)
+        SELECT trim(json_each.value) FROM images, json_each(images.tags)
+        WHERE json_valid(images.tags) AND trim(json_each.value) != ''
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO image_tags (image_id, tag_id)
+        SELECT images.image_id, tags.tag_id FROM images, json_each(images.tags)
+        JOIN tags ON tags.name = trim(json_each.value)
+        WHERE json_valid(images.tags)
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_tags")
+    conn.execute("DROP INDEX IF EXISTS idx_path")  # Duplicates the index behind UNIQUE (path)
+    if sqlite3.sqlite_version_info >= (3, 35):
+        conn.execute("ALTER TABLE images DROP COLUMN tags")
+    else:  # No DROP COLUMN before SQLite 3.35; the column stays but is no longer read or written
+        conn.execute("UPDATE images SET tags = NULL")
+
+
+class ConnectionPool:
+    """One connection per thread to the metadata database.
+
+    sqlite3 connections must not be shared between threads that use them at
+    the same time, so each thread (e.g. each FastAPI threadpool worker) gets
+    its own on first use and keeps it. WAL mode lets them all read while one
+    writes. The schema is migrated once, when the pool is created.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.migrated_from = migrate(self.connection())
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def insert_images(conn, rows):
+    """Insert or replace (image_id, path, tags, cluster_label) rows; tags is a list of names."""
+    rows = list(rows)
+    conn.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)",
+                     [(tag,) for _, _, tags, _ in rows for tag in tags])
+    # A replaced image's old image_tags rows go with it (ON DELETE CASCADE)
+    conn.executemany("INSERT OR REPLACE INTO images (image_id, path, cluster_label) VALUES (?, ?, ?)",
+                     [(image_id, path, cluster_label) for image_id, path, _, cluster_label in rows])
+    conn.executemany("INSERT OR IGNORE INTO image_tags (image_id, tag_id) SELECT ?, tag_id FROM tags WHERE name = ?",
+                     [(image_id, tag) for image_id, _, tags, _ in rows for tag in tags])
+
+
+def image_tags(conn, image_id):
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM image_tags JOIN tags USING (tag_id) WHERE image_id = ? ORDER BY name", (image_id,))]
+
+
+def paths_with_tags(conn, tags, count):
+    """Up to count random paths of images having any of tags (case-insensitive)."""
+    image_ids = [row[0] for row in conn.execute(
+        "SELECT DISTINCT image_id FROM image_tags WHERE tag_id IN (SELECT tag_id FROM tags WHERE name IN ({}))"
+        .format(",".join("?" * len(tags))), tags)]
+    image_ids = random.sample(image_ids, min(count, len(image_ids)))
+    return [row[0] for row in conn.execute(
+        "SELECT path FROM images WHERE image_id IN ({})".format(",".join("?" * len(image_ids))), image_ids)]
+
+
+def random_paths(conn, count):
+    """Up to count distinct random image paths without sorting the table.
+
+    Each draw picks a random rowid between the smallest and largest and takes
+    the first row at or after it, one primary-key seek per draw. Rows that
+    follow a gap left by deletions are somewhat more likely to be drawn.
+    """
+    low, high = conn.execute("SELECT min(rowid), max(rowid) FROM images").fetchone()
+    if low is None:
+        return []
+    found = {}
+    for _ in range(count * SAMPLE_ATTEMPTS):
+        if len(found) >= count:
+            break
+        row = conn.execute("SELECT rowid, path FROM images WHERE rowid >= ? ORDER BY rowid LIMIT 1",
+                           (random.randint(low, high),)).fetchone()
+        found[row[0]] = row[1]
+    if len(found) < count:  # Tables barely larger than count: top up in rowid order
+        for rowid, path in conn.execute("SELECT rowid, path FROM images ORDER BY rowid LIMIT ?",
+                                        (count + len(found),)):
+            if len(found) >= count:
+                break
+            found.setdefault(rowid, path)
+    return list(found.values())
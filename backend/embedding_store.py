@@ -0,0 +1,93 @@
+import numpy as np
+import os
+
+# dtype -> (vectors file, per-vector scales file)
+FILES = {
+    "float32": ("embeddings.npy", None),
+    "float16": ("embeddings_f16.npy", None),
+    "int8": ("embeddings_i8.npy", "embeddings_i8_scales.npy"),
+}
+
+
+def quantize(embeddings, dtype):
+    """Return (vectors, scales) for embeddings stored as dtype."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype == "float32":
+        return embeddings, None
+    if dtype == "float16":
+        return embeddings.astype(np.float16), None
+    if dtype == "int8":
+        # Symmetric per-vector scaling so every row uses the full int8 range
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        vectors = np.round(embeddings / scales[:, None]).astype(np.int8)
+        return vectors, scales.astype(np.float32)
+    raise ValueError(f"Unknown embedding dtype {dtype!r}; expected one of {tuple(FILES)}")
+
+
+def save_embeddings(embeddings, output_dir, dtype="float32"):
+    """Write embeddings in the given storage dtype and return the vectors file."""
+    vectors, scales = quantize(embeddings, dtype)
+    vectors_file, scales_file = FILES[dtype]
+    np.save(os.path.join(output_dir, vectors_file), vectors)
+    if scales_file:
+        np.save(os.path.join(output_dir, scales_file), scales)
+    return os.path.join(output_dir, vectors_file)
+
+
+class EmbeddingStore:
+    """Row accessor over stored embeddings, memory-mapped by default.
+
+    Rows come back as float32 regardless of the storage dtype. When no
+    embedding file is available the store falls back to index.reconstruct,
+    which works for flat and HNSW indexes (and approximately for PQ).
+    """
+
+    def __init__(self, vectors=None, scales=None, index=None):
+        if vectors is None and index is None:
+            raise ValueError("EmbeddingStore needs stored vectors or an index to reconstruct from")
+        self.vectors = vectors
+        self.scales = scales
+        self.index = index
+
+    @classmethod
+    def load(cls, data_dir, dtype="float32", index=None, mmap=True):
+        """Open the stored embeddings; dtype "index" reconstructs from the index only."""
+        if dtype == "index":
+            return cls(index=index)
+        vectors_file, scales_file = FILES[dtype]
+        mmap_mode = "r" if mmap else None
+        vectors_path = os.path.join(data_dir, vectors_file)
+        if not os.path.exists(vectors_path) and index is not None:
+            print(f"{vectors_path} not found; reconstructing embeddings from the index")
+            return cls(index=index)
+        vectors = np.load(vectors_path, mmap_mode=mmap_mode)
+        scales = np.load(os.path.join(data_dir, scales_file), mmap_mode=mmap_mode) if scales_file else None
+        return cls(vectors, scales, index)
+
+    @property
+    def dtype(self):
+        return "index" if self.vectors is None else str(self.vectors.dtype)
+
+    @property
+    def dim(self):
+        return self.index.d if self.vectors is None else self.vectors.shape[1]
+
+    def __len__(self):
+        return self.index.ntotal if self.vectors is None else len(self.vectors)
+
+    @property
+    def nbytes(self):
+        if self.vectors is None:
+            return 0
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def get(self, rows):
+        """Return the embeddings at rows as a contiguous (len(rows), dim) float32 array."""
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        if self.vectors is None:
+            return np.vstack([self.index.reconstruct(int(row)) for row in rows]).astype(np.float32)
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= np.asarray(self.scales[rows], dtype=np.float32)[:, None]
+        return np.ascontiguousarray(vectors)
@@ -1,18 +1,21 @@
 import os
 import json
-import sqlite3
 import torch
 from transformers import CLIPProcessor, CLIPModel
-from PIL import Image
 import numpy as np
 import faiss
 import uuid
-import torchvision.transforms as transforms
 from tqdm import tqdm
 import logging
-from torch.utils.data import DataLoader, Dataset
-from sklearn.mixture import GaussianMixture
+from torch.utils.data import DataLoader
 import glob
+import time
+from models.indexing import train_index, id_mapped, reconstruct_ids, remove_ids
+from models.manifest import Manifest
+from models.clustering import cluster_embeddings, format_report
+from models.tagging import TagEngine
+from models.preprocess import SharedImageDataset, collate_shared
+import db
 
 CONFIG = {
     "image_dir": "./data/images/",
@@ -20,10 +23,15 @@ CONFIG = {
     "db_file": "./data/metadata.db",
     "faiss_index_file": "./data/faiss_index.bin",
     "faiss_id_map_file": "./data/faiss_id_map.json",
+    "manifest_file": "./data/manifest.json",  # path -> size, mtime, content hash of ingested images
     "dimension": 768,  # DINOv2 vitb14
+    "index_factory": "HNSW16",  # FAISS factory string, e.g. "Flat", "IVF1024,Flat", "OPQ64,IVF1024,PQ64"
     "batch_size": 32,
-    "n_clusters": 20,  # For optional GMM clustering
-    "do_clustering": False,  # Set to True to enable GMM
+    "checkpoint_every": 1000,  # Persist index, id map and SQLite after this many new images...
+    "checkpoint_seconds": 300,  # ...or after this many seconds, whichever comes first
+    "n_clusters": 20,
+    "cluster_backend": "faiss",  # "faiss" (k-means), "minibatch" (MiniBatchKMeans) or "pca-gmm" (PCA + diagonal GMM)
+    "do_clustering": False,
     "tag_threshold": 0.2,  # Probability threshold for CLIP tags
     "min_tags": 1,  # Minimum number of tags per image
     "max_tags": 5,  # Maximum number of tags per image
@@ -65,26 +73,18 @@ logger.info(f"Using device: {device}")
 
 clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
 clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+tag_engine = TagEngine(clip_model, clip_processor, TAGS, device)  # Encodes TAGS once
 
 dino_model = torch.hub.load('facebookresearch/dinov2', 'dinov2_vitb14').to(device).eval()
 
 os.makedirs(CONFIG["output_dir"], exist_ok=True)
-conn = sqlite3.connect(CONFIG["db_file"])
+conn = db.connect(CONFIG["db_file"])
+db.migrate(conn)  # Tags live in tags/image_tags; older databases are converted in place (see db.py)
 cursor = conn.cursor()
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS images (
-        image_id TEXT PRIMARY KEY,
-        path TEXT UNIQUE,
-        tags TEXT,
-        cluster_label INTEGER
-    )
-""")
-cursor.execute("CREATE INDEX IF NOT EXISTS idx_path ON images (path)")
-cursor.execute("CREATE INDEX IF NOT EXISTS idx_tags ON images (tags)")
-conn.commit()
 
-index = faiss.IndexHNSWFlat(CONFIG["dimension"], 16)  # HNSW index with M=16
-index.hnsw.efConstruction = 200
+index = faiss.index_factory(CONFIG["dimension"], CONFIG["index_factory"])
+if hasattr(index, "hnsw"):
+    index.hnsw.efConstruction = 200
 id_map = {}
 
 if os.path.exists(CONFIG["faiss_index_file"]) and os.path.exists(CONFIG["faiss_id_map_file"]):
@@ -93,132 +93,181 @@ if os.path.exists(CONFIG["faiss_index_file"]) and os.path.exists(CONFIG["faiss_i
         id_map = json.load(f)
     logger.info(f"Loaded existing Faiss index with {index.ntotal} vectors")
 
-class ImageDataset(Dataset):
-    def __init__(self, image_paths):
-        self.image_paths = image_paths
-        self.transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-
-    def __len__(self):
-        return len(self.image_paths)
-
-    def __getitem__(self, idx):
-        path = self.image_paths[idx]
-        try:
-            image = Image.open(path).convert("RGB")
-            tensor = self.transform(image)
-            return tensor, path
-        except Exception as e:
-            logger.error(f"Error loading {path}: {e}")
-            return None, path
+# Explicit int64 ids (the keys of id_map) let deleted images be removed in place
+index = id_mapped(index)
 
 def generate_embeddings(loader):
-    embeddings = []
-    valid_paths = []
-    for batch_tensors, batch_paths in tqdm(loader, desc="Generating embeddings"):
-        valid_tensors = []
-        valid_indices = []
-        for i, tensor in enumerate(batch_tensors):
-            if tensor is not None:
-                valid_tensors.append(tensor)
-                valid_indices.append(i)
+    """Run DINOv2 and CLIP tagging on the same decoded batches.
+
+    Yields (embeddings, paths, tag_probs) per batch so callers can persist
+    progress as they go.
+    """
+    for dino_batch, clip_batch, batch_paths, failed in tqdm(loader, desc="Generating embeddings"):
+        for path in failed:
+            logger.error(f"Error loading {path}")
+        if not batch_paths:
+            continue
         
-        if valid_tensors:
-            batch_tensor = torch.stack(valid_tensors).to(device)
-            with torch.no_grad():
-                batch_embeddings = dino_model(batch_tensor).cpu().numpy()
-            for i, embedding in zip(valid_indices, batch_embeddings):
-                embedding = embedding / np.linalg.norm(embedding)
-                embeddings.append(embedding)
-                valid_paths.append(batch_paths[i])
-    
-    return np.array(embeddings), valid_paths
+        with torch.no_grad():
+            batch_embeddings = dino_model(dino_batch.to(device)).cpu().numpy()
+        batch_embeddings /= np.linalg.norm(batch_embeddings, axis=1, keepdims=True)
+        yield batch_embeddings.astype(np.float32), batch_paths, tag_engine.score(clip_batch)
 
-def cluster_embeddings(embeddings):
-    if len(embeddings) < CONFIG["n_clusters"]:
-        logger.warning(f"Too few embeddings ({len(embeddings)}) for {CONFIG['n_clusters']} clusters")
-        return np.zeros(len(embeddings), dtype=np.int32)
+def select_tags(image_path, probs):
+    tags = [TAGS[i] for i, prob in enumerate(probs) if prob > CONFIG["tag_threshold"]]
     
-    logger.info("Clustering embeddings with GMM...")
-    gmm = GaussianMixture(n_components=CONFIG["n_clusters"], covariance_type="full", random_state=42)
-    cluster_labels = gmm.fit_predict(embeddings)
-    logger.info("Clustering completed")
-    return cluster_labels
+    if len(tags) < CONFIG["min_tags"]:
+        top_n_indices = np.argsort(probs)[-CONFIG["top_n_tags"]:]
+        top_n_tags = [TAGS[i] for i in top_n_indices if TAGS[i] not in tags]
+        tags.extend(top_n_tags)
+        tags = tags[:CONFIG["max_tags"]]  # Cap at max_tags
+    
+    if not tags:
+        logger.warning(f"No confident tags for {image_path}; assigning 'general'")
+        return ["general"]
+    
+    logger.debug(f"Tags for {image_path}: {tags} (probs: {[probs[TAGS.index(tag)] for tag in tags]})")
+    return tags
+
+def write_atomic(path, write):
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+def checkpoint(manifest):
+    """Persist the index, id map, SQLite rows and manifest, in that order.
+
+    The manifest goes last, so anything not yet recorded there is simply
+    reprocessed on the next run (rows are upserted by path).
+    """
+    write_atomic(CONFIG["faiss_index_file"], lambda tmp: faiss.write_index(index, tmp))
+    def write_id_map(tmp):
+        with open(tmp, "w") as f:
+            json.dump(id_map, f)
+    write_atomic(CONFIG["faiss_id_map_file"], write_id_map)
+    conn.commit()
+    manifest.save()
+    logger.info(f"Checkpoint: {index.ntotal} vectors, {len(manifest.entries)} images in manifest")
+
+def remove_images(paths):
+    """Drop deleted or changed images from SQLite, the Faiss index and the id map."""
+    global index
+    if not paths:
+        return
+    image_ids = set()
+    for start in range(0, len(paths), 500):
+        chunk = paths[start:start + 500]
+        cursor.execute("SELECT image_id FROM images WHERE path IN ({})".format(",".join("?" * len(chunk))), chunk)
+        image_ids.update(row[0] for row in cursor.fetchall())
+    faiss_ids = [int(faiss_id) for faiss_id, image_id in id_map.items() if image_id in image_ids]
+    index = remove_ids(index, faiss_ids)
+    for faiss_id in faiss_ids:
+        del id_map[str(faiss_id)]
+    cursor.executemany("DELETE FROM images WHERE path = ?", [(p,) for p in paths])
+    logger.info(f"Removed {len(paths)} images ({len(faiss_ids)} vectors) from the index")
 
-def generate_tags(image_path):
+def recluster():
+    """Cluster every indexed vector and store the labels in SQLite."""
+    ids = faiss.vector_to_array(index.id_map)
     try:
-        image = Image.open(image_path).convert("RGB")
-        inputs = clip_processor(text=TAGS, images=image, return_tensors="pt", padding=True).to(device)
-        with torch.no_grad():
-            outputs = clip_model(**inputs)
-            logits_per_image = outputs.logits_per_image
-            probs = logits_per_image.softmax(dim=1).cpu().numpy()[0]
-        
-        tags = [TAGS[i] for i, prob in enumerate(probs) if prob > CONFIG["tag_threshold"]]
-        
-        if len(tags) < CONFIG["min_tags"]:
-            top_n_indices = np.argsort(probs)[-CONFIG["top_n_tags"]:]
-            top_n_tags = [TAGS[i] for i in top_n_indices if TAGS[i] not in tags]
-            tags.extend(top_n_tags)
-            tags = tags[:CONFIG["max_tags"]]  # Cap at max_tags
-        
-        if not tags:
-            logger.warning(f"No confident tags for {image_path}; assigning 'general'")
-            return ["general"]
+        vectors = reconstruct_ids(index, ids)
+    except RuntimeError as e:
+        logger.warning(f"Skipping clustering: the {CONFIG['index_factory']} index cannot reconstruct its vectors ({e})")
+        return
+    logger.info(f"Clustering {len(vectors)} vectors ({CONFIG['cluster_backend']})...")
+    cluster_labels, report = cluster_embeddings(vectors, n_clusters=CONFIG["n_clusters"], backend=CONFIG["cluster_backend"])
+    logger.info(f"Clustering completed: {format_report(report)}")
+    cursor.executemany(
+        "UPDATE images SET cluster_label = ? WHERE image_id = ?",
+        [(int(label), id_map[str(faiss_id)]) for faiss_id, label in zip(ids, cluster_labels) if str(faiss_id) in id_map]
+    )
+    conn.commit()
+
+def add_batches(batches, manifest, next_id):
+    """Add embedded batches to the index and SQLite; returns (next_id, images added)."""
+    if not index.is_trained:
+        # IVF/PQ factories need training before the first vectors are added
+        training = np.vstack([embeddings for embeddings, _, _ in batches])
+        logger.info(f"Training {CONFIG['index_factory']} index on {len(training)} vectors")
+        train_index(index, training)
+    
+    added = 0
+    for embeddings, valid_paths, tag_probs in batches:
+        faiss_ids = np.arange(next_id, next_id + len(embeddings), dtype=np.int64)
+        next_id += len(embeddings)
+        index.add_with_ids(embeddings, faiss_ids)
         
-        logger.debug(f"Tags for {image_path}: {tags} (probs: {[probs[TAGS.index(tag)] for tag in tags]})")
-        return tags
-    except Exception as e:
-        logger.error(f"Error tagging {image_path}: {e}")
-        return ["error"]
+        metadata = []
+        for faiss_id, path, probs in zip(faiss_ids, valid_paths, tag_probs):
+            image_id = str(uuid.uuid4())
+            id_map[str(faiss_id)] = image_id
+            metadata.append((image_id, path, select_tags(path, probs), -1))
+        db.insert_images(conn, metadata)
+        manifest.mark_done(valid_paths)
+        added += len(metadata)
+    return next_id, added
 
 def process_images(image_paths):
-    # Filter out already processed images
-    cursor.execute("SELECT path FROM images")
-    processed_paths = set(row[0] for row in cursor.fetchall())
-    image_paths = [p for p in image_paths if p not in processed_paths]
+    global index
+    manifest = Manifest.load(CONFIG["manifest_file"])
+    if not manifest.entries:
+        # First run with a manifest: adopt images already in the database instead of re-embedding them
+        cursor.execute("SELECT path FROM images")
+        known = [row[0] for row in cursor.fetchall() if os.path.exists(row[0])]
+        manifest.diff(known)
+        manifest.mark_done(known)
+    
+    changes = manifest.diff(image_paths)
+    logger.info(f"Manifest diff: {len(changes.new)} new, {len(changes.changed)} changed, "
+                f"{len(changes.deleted)} deleted, {len(changes.unchanged)} unchanged")
+    remove_images(changes.deleted + changes.changed)
+    manifest.remove(changes.deleted)
+    image_paths = changes.new + changes.changed
     
     if not image_paths:
         logger.info("No new images to process")
+        checkpoint(manifest)
         return
     
     logger.info(f"Processing {len(image_paths)} new images")
     
     # Create DataLoader for efficient batch processing
-    dataset = ImageDataset(image_paths)
-    loader = DataLoader(dataset, batch_size=CONFIG["batch_size"], num_workers=4, pin_memory=True)
-    
-    embeddings, valid_paths = generate_embeddings(loader)
-    
-    # Optional clustering
-    cluster_labels = cluster_embeddings(embeddings) if CONFIG["do_clustering"] else [-1] * len(embeddings)
+    # Each image is decoded once; DINOv2 and CLIP consume the same batch
+    dataset = SharedImageDataset(image_paths)
+    loader = DataLoader(dataset, batch_size=CONFIG["batch_size"], num_workers=4, pin_memory=True,
+                        collate_fn=collate_shared)
     
-    metadata = []
-    for path, embedding, cluster_label in zip(valid_paths, embeddings, cluster_labels):
-        image_id = str(uuid.uuid4())
-        tags = generate_tags(path)
-        if tags == ["error"]:
+    next_id = max((int(faiss_id) for faiss_id in id_map), default=-1) + 1
+    processed = 0
+    since_checkpoint = 0
+    last_checkpoint = time.time()
+    pending = []  # Batches held back until an IVF/PQ index has enough vectors to train on
+    for batch in generate_embeddings(loader):
+        pending.append(batch)
+        if not index.is_trained and sum(len(b[0]) for b in pending) < CONFIG["checkpoint_every"]:
             continue
+        next_id, added = add_batches(pending, manifest, next_id)
+        pending = []
+        processed += added
+        since_checkpoint += added
         
-        metadata.append((image_id, path, json.dumps(tags), cluster_label))
-        faiss_id = index.ntotal
-        index.add(np.array([embedding], dtype=np.float32))
-        id_map[str(faiss_id)] = image_id
-        
-        # Checkpoint after each image to allow resuming
-        cursor.executemany(
-            "INSERT INTO images (image_id, path, tags, cluster_label) VALUES (?, ?, ?, ?)",
-            [metadata[-1]]
-        )
-        conn.commit()
-        faiss.write_index(index, CONFIG["faiss_index_file"])
-        with open(CONFIG["faiss_id_map_file"], "w") as f:
-            json.dump(id_map, f)
+        # Checkpoint every N images or T seconds to allow resuming
+        if (since_checkpoint >= CONFIG["checkpoint_every"]
+                or time.time() - last_checkpoint >= CONFIG["checkpoint_seconds"]):
+            checkpoint(manifest)
+            since_checkpoint = 0
+            last_checkpoint = time.time()
+    if pending:
+        next_id, added = add_batches(pending, manifest, next_id)
+        processed += added
+    
+    checkpoint(manifest)
+    
+    # Optional clustering, over the whole corpus so labels stay comparable across runs
+    if CONFIG["do_clustering"]:
+        recluster()
     
-    logger.info(f"Processed {len(metadata)} images. Total in Faiss: {index.ntotal}")
+    logger.info(f"Processed {processed} images. Total in Faiss: {index.ntotal}")
 
 def main():
     # Normalize and validate image directory
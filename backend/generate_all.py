@@ -1,120 +1,173 @@
+"""Build a new data bundle (embeddings, tags, indexes, k-NN graph, tile atlas) from IMAGE_DIR.
+
+Incremental only at the image level: with INCREMENTAL, embeddings, CLIP
+embeddings, tag probabilities and atlas tiles of images unchanged since the
+last run (data/manifest.json) are copied from the current bundle. The FAISS
+indexes, clusters and k-NN graph are rebuilt from all rows on every run,
+and there is no mid-run checkpoint; a run that fails leaves nothing behind
+and the next one starts over. Checkpointed ingestion into an id-mapped index
+with in-place deletes is generate_all new.py (SQLite metadata).
+"""
 import torch
-from torchvision import transforms
-from PIL import Image
+from torch.utils.data import DataLoader
 import numpy as np
-from sklearn.mixture import GaussianMixture
 import faiss
 from transformers import CLIPProcessor, CLIPModel
-import json
 import os
+import contextlib
 from tqdm import tqdm  # For progress bars
+from models.knn_graph import build_knn_graph
+from embedding_store import save_embeddings
+from models.indexing import build_index
+from models.tagging import TagEngine
+from models.preprocess import SharedImageDataset, collate_timed
+from models.profiling import PipelineProfiler, format_report as format_profile, torch_trace
+from models.inference import CHECK_IMAGES, accelerate, configure_threads
+from models.manifest import Manifest
+from models.clustering import cluster_embeddings, format_report
+from tag_scores import TagScores, save_tag_probs
+from thumbnails import ThumbnailCache
+from moodboard import build_atlas, load_atlas, load_atlas_failures, ATLAS_FILE
+import bundle
+from tags import TAGS  # Tag vocabulary, shared with benchmarks/synthetic_corpus.py
 
 # Configuration
 IMAGE_DIR = "./data/images/"  # Directory with your images
 OUTPUT_DIR = "./data/"        # Directory to save output files
-N_CLUSTERS = 20               # Number of GMM clusters (adjustable)
+N_CLUSTERS = 20               # Number of clusters (adjustable)
+CLUSTER_BACKEND = "faiss"     # "faiss" (k-means), "minibatch" (MiniBatchKMeans) or "pca-gmm" (PCA + diagonal GMM)
 BATCH_SIZE = 32               # Batch size for embedding generation
+NUM_WORKERS = 4               # Decode/resize worker processes
+EMBEDDING_DTYPE = "float32"   # Extra serving copy of the embeddings: "float16" or "int8" to shrink it
+INDEX_FACTORY = "Flat"        # FAISS factory string, e.g. "HNSW32", "IVF1024,Flat", "OPQ64,IVF1024,PQ64"
+INCREMENTAL = True            # Reuse embeddings/tags of images unchanged since the last run (data/manifest.json)
+THUMBNAIL_SIZES = ()          # Pre-render thumbnails served by /api/thumbnails, e.g. (256,) or (128, 256, 512)
+TILE_ATLAS = True             # Pre-resized 200x200 moodboard tiles (N x 200 x 200 x 3 uint8, ~120KB per image)
+KNN_K = 100                   # Neighbors precomputed per image (0 disables the k-NN graph)
+CLIP_INDEX_FACTORY = "Flat"   # FAISS factory for the CLIP image-embedding index behind free-text search
+PROFILE_REPORT = "pipeline_profile.json"  # Per-stage items/sec, blocked time and peak RSS, written to OUTPUT_DIR
+PROFILE_TRACE_BATCH = None    # Batch number to capture in a torch profiler trace (profile_trace.json), e.g. 3
+INFERENCE_BACKEND = "eager"   # CPU encoders: "eager", "compile", "int8" or "onnx" (models/inference.py);
+                              # accepted only if it matches fp32 on real images, else eager is used
+TORCH_THREADS = None          # Intra-op threads for inference (None: torch default); keep NUM_WORKERS cores free
+INTEROP_THREADS = None        # Inter-op threads (None: torch default)
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
-# Your 109 tags
-TAGS = [
-    "illustration", "collage", "3D render", "motion graphics", "animation", "painting", "drawing",
-    "sculpture", "printmaking", "installation art", "AR/VR", "AI-generated", "cinematography",
-    "fashion design", "product design", "industrial design", "UI design", "architecture",
-    "interior design", "layout", "grid system", "negative space", "balance", "asymmetry",
-    "overlap", "depth", "iconography", "diagram", "map", "infographic", "emoji", "logomark",
-    "pictogram", "double exposure", "halftone", "glitch", "pixel art", "datamoshing", "silhouette",
-    "line art", "scanography", "hand-drawn", "metal", "glass", "concrete", "plastic", "paper",
-    "fabric", "wood", "skin", "fur", "water", "fire", "smoke", "dust", "mirror", "black & white",
-    "monochrome", "neon", "pastel", "primary colors", "complementary", "analogous", "duotone",
-    "CMYK", "RGB", "warm", "cool", "neutral", "vivid", "muted", "earth tones", "sunset tones",
-    "underwater tones", "futuristic palette", "natural palette", "nostalgic palette",
-    "psychedelic colors", "vaporwave palette", "minimal palette", "high contrast", "brutalism",
-    "minimalism", "maximalism", "cyberpunk", "solarpunk", "biophilic", "memphis", "bauhaus",
-    "de stijl", "baroque", "vintage", "retro-futurism", "Y2K", "new ugly", "editorial",
-    "high fashion", "corporate memphis", "dada", "surrealism", "art deco", "modernist",
-    "dreamy", "gritty", "ethereal", "industrial", "romantic", "playful", "melancholy", "serene",
-    "bold", "mysterious", "chaotic", "clinical", "organic", "eerie", "luxurious",
-    "editorial layout", "poster design", "book cover", "packaging", "social post", "web landing page",
-    "billboard", "pitch deck", "logo system", "ad campaign"
-]
-
-# Load CLIP model and processor
+configure_threads(TORCH_THREADS, INTEROP_THREADS)  # Must run before torch does any parallel work
+
+# Load CLIP model and processor; the tag vocabulary is encoded once here
 model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(DEVICE)
 processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+tag_engine = TagEngine(model, processor, TAGS, DEVICE)
 
-# Preprocessing for DINOv2
+# Load DINOv2 (preprocessing for both models lives in models/preprocess.py)
 dinov2 = torch.hub.load('facebookresearch/dinov2', 'dinov2_vitb14').to(DEVICE).eval()
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
-
-def generate_embeddings(image_paths, output_file):
-    """Generate DINOv2 embeddings for all images."""
-    embeddings = []
+dino_encoder = dinov2  # Replaced by the INFERENCE_BACKEND version in prepare_encoders()
+inference_reports = {}
+
+profiler = PipelineProfiler()
+
+def prepare_encoders(dataset):
+    """Switch DINOv2 and the CLIP image encoder to INFERENCE_BACKEND, once, if it
+    passes the accuracy check against fp32 on the first CHECK_IMAGES images."""
+    global dino_encoder
+    if INFERENCE_BACKEND == "eager" or inference_reports or len(dataset) == 0:
+        return
+    if DEVICE != "cpu":
+        print(f"INFERENCE_BACKEND={INFERENCE_BACKEND} targets CPU; using eager on {DEVICE}")
+        inference_reports["skipped"] = DEVICE
+        return
+    dino_example, clip_example, paths, _, _ = collate_timed([dataset[i] for i in range(min(len(dataset), CHECK_IMAGES))])
+    if not paths:
+        return
+    onnx_dir = os.path.join(OUTPUT_DIR, "onnx")
+    dino_encoder, inference_reports["dinov2"] = accelerate(dinov2, INFERENCE_BACKEND, dino_example, "dinov2",
+                                                           onnx_dir=onnx_dir)
+    tag_engine.image_encoder, inference_reports["clip"] = accelerate(
+        tag_engine.image_encoder, INFERENCE_BACKEND, clip_example, "clip",
+        text_embeddings=tag_engine.text_embeddings, onnx_dir=onnx_dir)
+
+def embed_and_tag(image_paths):
+    """Generate DINOv2 embeddings, CLIP image embeddings and CLIP tag probabilities
+    in one pass, decoding each image once.
+
+    Unreadable images are dropped from every output so metadata rows always
+    line up with embedding (and FAISS) rows.
+    """
+    embeddings = [np.empty((0, 768), dtype=np.float32)]
+    clip_embeddings = [np.empty((0, tag_engine.text_embeddings.shape[1]), dtype=np.float32)]
+    tag_probs = [np.empty((0, len(TAGS)), dtype=np.float16)]
+    metadata = []
     
-    print("Generating embeddings...")
-    for i in tqdm(range(0, len(image_paths), BATCH_SIZE), desc="Embedding batches"):
-        batch_paths = image_paths[i:i + BATCH_SIZE]
-        batch_images = []
-        for path in batch_paths:
-            try:
-                image = Image.open(path).convert("RGB")
-                tensor = transform(image)
-                batch_images.append(tensor)
-            except Exception as e:
-                print(f"Error processing {path}: {e}")
-                continue
-        
-        if batch_images:
-            batch_tensor = torch.stack(batch_images).to(DEVICE)
-            with torch.no_grad():
-                batch_embeddings = dinov2(batch_tensor).cpu().numpy()
-            embeddings.append(batch_embeddings)
+    print(f"Generating embeddings and tags for {len(image_paths)} images...")
+    dataset = SharedImageDataset(image_paths)
+    prepare_encoders(dataset)
+    loader = DataLoader(dataset, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, collate_fn=collate_timed)
+    batches = iter(tqdm(loader, desc="Embedding batches"))
+    for batch_number in range(len(loader)):
+        # Time the model stages spend waiting on the read/decode/transform workers
+        with profiler.wait("dinov2"):
+            dino_batch, clip_batch, batch_paths, failed, timings = next(batches)
+        for stage, seconds in timings.items():
+            profiler.record(stage, seconds, items=len(batch_paths), workers=max(NUM_WORKERS, 1))
+        for path in failed:
+            print(f"Error processing {path}; skipping")
+        if not batch_paths:
+            continue
+        trace = batch_number == PROFILE_TRACE_BATCH
+        with torch_trace(os.path.join(OUTPUT_DIR, "profile_trace.json")) if trace else contextlib.nullcontext():
+            with profiler.stage("dinov2", items=len(batch_paths)), torch.no_grad():
+                batch_embeddings = dino_encoder(dino_batch.to(DEVICE)).cpu().numpy()
+            with profiler.stage("clip", items=len(batch_paths)):
+                batch_probs, batch_clip = tag_engine.score_and_embed(clip_batch)
+        embeddings.append(batch_embeddings)
+        clip_embeddings.append(batch_clip)
+        tag_probs.append(batch_probs.astype(np.float16))
+        for path, probs in zip(batch_paths, batch_probs):
+            metadata.append({"path": path, "tags": tag_engine.top_tags(probs)})  # Top 3 tags
     
-    embeddings = np.vstack(embeddings)
-    np.save(output_file, embeddings)
-    return embeddings
-
-def cluster_embeddings(embeddings, output_file):
-    """Cluster embeddings with GMM."""
-    print("Clustering embeddings...")
-    gmm = GaussianMixture(n_components=N_CLUSTERS, covariance_type='full', random_state=42)
-    cluster_labels = gmm.fit_predict(embeddings)
-    np.save(output_file, cluster_labels)
-    return cluster_labels
+    return np.vstack(embeddings), np.vstack(clip_embeddings), np.vstack(tag_probs), metadata
+
+def load_previous(path):
+    return np.load(path, mmap_mode="r") if os.path.exists(path) else None
+
+def load_previous_metadata(previous_dir):
+    has_metadata = os.path.exists(os.path.join(previous_dir, bundle.MANIFEST_FILE)) or \
+        os.path.exists(os.path.join(previous_dir, "metadata.json"))
+    return bundle.read_metadata(previous_dir) if has_metadata else None
+
+def load_previous_tag_probs(previous_dir):
+    """Last run's tag probabilities as an (N, len(TAGS)) view, if the vocabulary is unchanged."""
+    previous = TagScores.load(previous_dir)
+    return previous.probs.T if previous is not None and previous.tags == TAGS else None
+
+def reuse_previous(paths, previous, arrays):
+    """Return (metadata, arrays) rows of the last run for paths still valid there.
+
+    previous is the last run's metadata and arrays its per-row outputs
+    (embeddings, ...), None where missing. If any is missing or out of sync,
+    nothing is reused.
+    """
+    nothing = [], [None] * len(arrays)
+    if not paths or previous is None or any(array is None for array in arrays):
+        return nothing
+    if any(len(array) != len(previous) for array in arrays):
+        print("Previous embeddings and metadata are out of sync; recomputing everything")
+        return nothing
+    keep = set(paths)
+    rows = [i for i, meta in enumerate(previous) if meta["path"] in keep]
+    return [previous[i] for i in rows], [np.array(array[rows]) for array in arrays]
+
+def append_rows(reused, new):
+    return new if reused is None else np.concatenate([reused, new.astype(reused.dtype)])
 
 def index_embeddings(embeddings, output_file):
     """Index embeddings with FAISS."""
     print("Indexing embeddings with FAISS...")
     faiss.normalize_L2(embeddings)
-    index = faiss.IndexFlatL2(768)  # DINOv2 embedding size
-    index.add(embeddings)
+    index = build_index(embeddings, INDEX_FACTORY)  # Trains IVF/PQ stages when needed
     faiss.write_index(index, output_file)
-
-def tag_images(image_paths, output_file):
-    """Tag images with CLIP (zero-shot)."""
-    metadata = []
-    print("Tagging images...")
-    for path in tqdm(image_paths, desc="Tagging"):
-        try:
-            image = Image.open(path).convert("RGB")
-            inputs = processor(text=TAGS, images=image, return_tensors="pt", padding=True).to(DEVICE)
-            with torch.no_grad():
-                outputs = model(**inputs)
-                logits_per_image = outputs.logits_per_image
-                probs = logits_per_image.softmax(dim=1).cpu().numpy()[0]
-            top_tags = [TAGS[i] for i in np.argsort(probs)[-3:]]  # Top 3 tags
-            metadata.append({"path": path, "tags": top_tags})
-        except Exception as e:
-            print(f"Error tagging {path}: {e}")
-            metadata.append({"path": path, "tags": []})
-    
-    with open(output_file, "w") as f:
-        json.dump(metadata, f)
-    return metadata
+    return index
 
 def main():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -126,27 +179,112 @@ def main():
         raise ValueError(f"No images found in {IMAGE_DIR}")
     print(f"Found {len(image_paths)} images.")
 
-    # Step 2: Generate embeddings
-    embeddings_file = os.path.join(OUTPUT_DIR, "embeddings.npy")
-    embeddings = generate_embeddings(image_paths, embeddings_file)
+    # Every output of this run goes into a new bundle directory (data/bundles/<version>.partial)
+    # that only becomes the served generation once bundle.publish() has validated it;
+    # the previous generation (or legacy flat files in OUTPUT_DIR) is the reuse source
+    previous_dir = bundle.current(OUTPUT_DIR) or OUTPUT_DIR
+    bundle_dir = bundle.staging_dir(OUTPUT_DIR)
+
+    # Step 2: Generate embeddings and tag images (single decode per image),
+    # only for images that are new or changed since the last run
+    embeddings_file = os.path.join(bundle_dir, "embeddings.npy")
+    clip_embeddings_file = os.path.join(bundle_dir, "clip_embeddings.npy")
+    manifest = Manifest.load(os.path.join(OUTPUT_DIR, "manifest.json"))
+    changes = manifest.diff(image_paths)
+    print(f"{len(changes.new)} new, {len(changes.changed)} changed, {len(changes.deleted)} deleted, "
+          f"{len(changes.unchanged)} unchanged images")
+    previous_metadata = load_previous_metadata(previous_dir)
+    reused_metadata, (reused_embeddings, reused_clip, reused_probs) = reuse_previous(
+        changes.unchanged if INCREMENTAL else [], previous_metadata,
+        [load_previous(os.path.join(previous_dir, "embeddings.npy")),
+         load_previous(os.path.join(previous_dir, "clip_embeddings.npy")),
+         load_previous_tag_probs(previous_dir)])
+    reused = {meta["path"] for meta in reused_metadata}
+    new_embeddings, new_clip, new_probs, new_metadata = embed_and_tag([p for p in image_paths if p not in reused])
+    embeddings = append_rows(reused_embeddings, new_embeddings)
+    clip_embeddings = append_rows(reused_clip, new_clip)
+    tag_probs = append_rows(reused_probs, new_probs)
+    metadata = reused_metadata + new_metadata
+    if not metadata:
+        raise ValueError("No images could be processed")
+    with profiler.stage("write", items=len(metadata)):
+        np.save(embeddings_file, embeddings)
+        np.save(clip_embeddings_file, clip_embeddings)
+        save_tag_probs(tag_probs, TAGS, bundle_dir)  # Full N x len(TAGS) probabilities, float16
+        tags = bundle.write_metadata(bundle_dir, metadata, TAGS)  # Path table and int-coded tags
+        if EMBEDDING_DTYPE != "float32":
+            save_embeddings(embeddings, bundle_dir, EMBEDDING_DTYPE)
 
     # Step 3: Cluster embeddings
-    cluster_file = os.path.join(OUTPUT_DIR, "cluster_labels.npy")
-    cluster_labels = cluster_embeddings(embeddings, cluster_file)
+    cluster_file = os.path.join(bundle_dir, "cluster_labels.npy")
+    print(f"Clustering embeddings ({CLUSTER_BACKEND})...")
+    with profiler.stage("cluster", items=len(metadata)):
+        cluster_labels, cluster_report = cluster_embeddings(embeddings_file, cluster_file, N_CLUSTERS, CLUSTER_BACKEND)
 
     # Step 4: Index embeddings with FAISS
-    faiss_file = os.path.join(OUTPUT_DIR, "faiss_index.bin")
-    index_embeddings(embeddings, faiss_file)
+    faiss_file = os.path.join(bundle_dir, "faiss_index.bin")
+    with profiler.stage("faiss_index", items=len(metadata)):
+        index = index_embeddings(embeddings, faiss_file)
 
-    # Step 5: Tag images and generate metadata
-    metadata_file = os.path.join(OUTPUT_DIR, "metadata.json")
-    metadata = tag_images(image_paths, metadata_file)
+    # Step 4a: Index CLIP image embeddings for free-text queries
+    clip_index_file = os.path.join(bundle_dir, "clip_index.bin")
+    with profiler.stage("clip_index", items=len(metadata)):
+        faiss.write_index(build_index(clip_embeddings, CLIP_INDEX_FACTORY), clip_index_file)
+
+    # Step 4b: Precompute the k-NN graph used for locked browsing
+    if KNN_K:
+        with profiler.stage("knn_graph", items=len(metadata)):
+            build_knn_graph(embeddings, index, bundle_dir, k=KNN_K)
+
+    # Step 5 (optional): Pre-render thumbnails so the first page view does not pay for decoding
+    if THUMBNAIL_SIZES:
+        print("Rendering thumbnails...")
+        with profiler.stage("thumbnails", items=len(metadata) * len(THUMBNAIL_SIZES)):
+            failures = ThumbnailCache(os.path.join(OUTPUT_DIR, "thumbnails")).pregenerate(
+                [meta["path"] for meta in metadata], THUMBNAIL_SIZES)
+        print(f"Rendered thumbnails at sizes {THUMBNAIL_SIZES} ({failures} failures)")
+
+    # Step 6: Build the moodboard tile atlas so /api/save never decodes originals;
+    # tiles of reused images are copied from the previous generation's atlas
+    if TILE_ATLAS:
+        print("Building moodboard tile atlas...")
+        previous_atlas = load_atlas(previous_dir, expected_rows=len(previous_metadata)) if reused else None
+        previous_failed = load_atlas_failures(previous_dir, expected_rows=len(previous_metadata)) if reused else None
+        previous_row = {meta["path"]: i for i, meta in enumerate(previous_metadata or []) if meta["path"] in reused
+                        and (previous_failed is None or not previous_failed[i])}  # Failed tiles are retried
+        with profiler.stage("atlas", items=len(metadata) - len(reused)):
+            atlas_failures, atlas_reused = build_atlas(
+                [meta["path"] for meta in metadata], os.path.join(bundle_dir, ATLAS_FILE), previous=previous_atlas,
+                previous_rows=[previous_row.get(meta["path"]) for meta in metadata])
+
+    # Step 7: Validate row alignment, checksum and switch data/bundles/CURRENT to this run;
+    # only then record the processed images in the ingestion manifest
+    with profiler.stage("publish", items=len(metadata)):
+        bundle_dir = bundle.publish(bundle_dir, tags, index_factory=INDEX_FACTORY, embedding_dtype=EMBEDDING_DTYPE)
+    manifest.remove(changes.deleted)
+    manifest.mark_done(meta["path"] for meta in new_metadata)
+    manifest.save()
 
     print("All tasks completed successfully!")
-    print(f"- Embeddings: {embeddings_file} ({embeddings.shape})")
-    print(f"- Cluster labels: {cluster_file} ({len(cluster_labels)} labels)")
-    print(f"- FAISS index: {faiss_file}")
-    print(f"- Metadata: {metadata_file} ({len(metadata)} entries)")
+    print(f"- Bundle: {bundle_dir} ({len(metadata)} rows)")
+    print(f"- Embeddings: {embeddings.shape}")
+    print(f"- Cluster labels: {len(cluster_labels)} labels, {format_report(cluster_report)}")
+    print(f"- FAISS index: {INDEX_FACTORY}, CLIP index: {clip_embeddings.shape}")
+    if KNN_K:
+        print(f"- k-NN graph: {len(embeddings)} x {min(KNN_K, len(embeddings))}")
+    print(f"- Tag probabilities: {tag_probs.shape[1]} x {tag_probs.shape[0]} float16")
+    if TILE_ATLAS:
+        print(f"- Tile atlas: {len(metadata)} tiles ({atlas_reused} reused), {atlas_failures} failures")
+
+    # Which stage bounds the run: compare items/sec and how long the model stages sat waiting
+    report = profiler.save(os.path.join(OUTPUT_DIR, PROFILE_REPORT), bundle=os.path.basename(bundle_dir),
+                           images=len(image_paths), embedded=len(new_metadata), device=DEVICE,
+                           batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, torch_threads=torch.get_num_threads(),
+                           interop_threads=torch.get_num_interop_threads(),
+                           inference_backend=INFERENCE_BACKEND, inference=inference_reports,
+                           index_factory=INDEX_FACTORY, cluster_backend=CLUSTER_BACKEND)
+    print(f"- Pipeline profile: {os.path.join(OUTPUT_DIR, PROFILE_REPORT)}")
+    print(format_profile(report))
 
 if __name__ == "__main__":
     try:
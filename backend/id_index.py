@@ -0,0 +1,92 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+def path_hash(path):
+    """64-bit hash of the normalized path, as stored in data bundles."""
+    digest = hashlib.blake2b(os.path.normpath(path).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class HashedPaths:
+    """Path -> row lookup by binary search over sorted path hashes.
+
+    Needs no per-path Python objects, so it opens instantly over memory-mapped
+    bundle arrays; the candidate row's path is compared to rule out collisions.
+    """
+
+    def __init__(self, paths, hashes, rows):
+        self.paths = paths
+        self.hashes = hashes
+        self.rows = rows
+
+    def get(self, path, default=None):
+        key = np.uint64(path_hash(path))
+        normalized = os.path.normpath(path)
+        i = int(np.searchsorted(self.hashes, key))
+        while i < len(self.hashes) and self.hashes[i] == key:
+            row = int(self.rows[i])
+            if os.path.normpath(self.paths[row]) == normalized:
+                return row
+            i += 1
+        return default
+
+
+class IdIndex:
+    """Constant-time lookups between image path, index row and image id.
+
+    Rows are FAISS row numbers (the position of the image in metadata for the
+    JSON pipeline). Image ids are optional and only used by the SQLite
+    pipeline, where FAISS rows map to UUIDs through faiss_id_map.json.
+    """
+
+    def __init__(self, paths=(), image_ids=None):
+        self.paths = list(paths)
+        self.rows_by_path = {}
+        for row, path in enumerate(self.paths):
+            self.rows_by_path.setdefault(path, row)
+            self.rows_by_path.setdefault(os.path.normpath(path), row)
+        self.image_ids = {}
+        self.rows_by_id = {}
+        for row, image_id in (image_ids or {}).items():
+            self.image_ids[int(row)] = image_id
+            self.rows_by_id[image_id] = int(row)
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        return cls(meta["path"] for meta in metadata)
+
+    @classmethod
+    def from_bundle(cls, metadata):
+        """Build over a BundleMetadata's path table and hash arrays without a dict pass."""
+        index = cls()
+        index.paths = metadata.paths
+        index.rows_by_path = HashedPaths(metadata.paths, metadata.path_hashes, metadata.path_hash_rows)
+        return index
+
+    @classmethod
+    def from_id_map(cls, id_map):
+        """Build from a {faiss_row: image_id} map as written by the generator."""
+        return cls(image_ids=id_map)
+
+    def __len__(self):
+        return max(len(self.paths), len(self.image_ids))
+
+    def row(self, path):
+        """Return the row for path, or None when the path is not indexed."""
+        row = self.rows_by_path.get(path)
+        if row is None:
+            row = self.rows_by_path.get(os.path.normpath(path))
+        return row
+
+    def path(self, row):
+        return self.paths[row]
+
+    def row_for_id(self, image_id):
+        """Return the FAISS row for image_id, or None when it has no embedding."""
+        return self.rows_by_id.get(image_id)
+
+    def image_id(self, row):
+        return self.image_ids.get(row)
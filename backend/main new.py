@@ -1,11 +1,12 @@
-import sqlite3
 import json
 import faiss
 import numpy as np
 from PIL import Image
-import random
 import os
 import logging
+from id_index import IdIndex
+import db
+from models.indexing import apply_search_params, default_search_params
 
 # Configuration
 DATA_DIR = "./data/"
@@ -15,6 +16,7 @@ FAISS_ID_MAP_FILE = os.path.join(DATA_DIR, "faiss_id_map.json")
 IMAGE_DIR = os.path.join(DATA_DIR, "images/")
 MOODBOARD_FILE = os.path.join(DATA_DIR, "moodboard.png")
 LOG_FILE = os.path.join(DATA_DIR, "test_data.log")
+SEARCH_PARAMS = None  # e.g. "efSearch=100" (HNSW) or "nprobe=16" (IVF); None picks defaults for the loaded index type
 
 # Setup logging
 logging.basicConfig(
@@ -27,6 +29,7 @@ logger = logging.getLogger()
 # Initialize Faiss index
 try:
     index = faiss.read_index(FAISS_INDEX_FILE)
+    apply_search_params(index, SEARCH_PARAMS if SEARCH_PARAMS is not None else default_search_params(index))
     logger.info(f"Loaded Faiss index with {index.ntotal} vectors")
 except Exception as e:
     logger.error(f"Failed to load Faiss index: {e}")
@@ -36,17 +39,19 @@ except Exception as e:
 try:
     with open(FAISS_ID_MAP_FILE, "r") as f:
         id_map = json.load(f)
+    id_index = IdIndex.from_id_map(id_map)
     logger.info(f"Loaded Faiss ID map with {len(id_map)} entries")
 except Exception as e:
     logger.error(f"Failed to load Faiss ID map: {e}")
     raise ValueError(f"Failed to load Faiss ID map: {e}")
 
+# One WAL-mode connection per calling thread; opening the pool migrates a
+# database still storing tags as JSON to the tags/image_tags tables
 try:
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM images")
-    db_count = cursor.fetchone()[0]
-    logger.info(f"Connected to SQLite database with {db_count} entries")
+    pool = db.ConnectionPool(DB_FILE)
+    if pool.migrated_from < db.SCHEMA_VERSION:
+        logger.info(f"Migrated {DB_FILE} from schema version {pool.migrated_from} to {db.SCHEMA_VERSION}")
+    logger.info(f"Connected to SQLite database {DB_FILE}")
 except Exception as e:
     logger.error(f"Failed to connect to SQLite database: {e}")
     raise ValueError(f"Failed to connect to SQLite database: {e}")
@@ -57,15 +62,14 @@ locked_embedding = None
 def search(query: str):
     global locked_embedding
     try:
+        conn = pool.connection()
         if locked_embedding is not None:
             # Similarity search using Faiss
-            index.hnsw.efSearch = 100  # Adjust for accuracy vs. speed
             distances, indices = index.search(locked_embedding, k=7)
             image_ids = [id_map.get(str(idx)) for idx in indices[0] if str(idx) in id_map]
-            cursor.execute("SELECT path FROM images WHERE image_id IN ({})".format(
+            paths = [row[0] for row in conn.execute("SELECT path FROM images WHERE image_id IN ({})".format(
                 ",".join("?" * len(image_ids))
-            ), image_ids)
-            paths = [row[0] for row in cursor.fetchall()]
+            ), image_ids)]
             logger.info(f"Similarity search returned {len(paths)} images")
             return {"images": paths}
         
@@ -73,27 +77,13 @@ def search(query: str):
         query_tags = [tag.strip().lower() for tag in query.split(",") if tag.strip()]
         if not query_tags:
             logger.warning("Empty query; returning random images")
-            cursor.execute("SELECT path FROM images ORDER BY RANDOM() LIMIT 7")
-            paths = [row[0] for row in cursor.fetchall()]
-            return {"images": paths}
-        
-        # Search for images with matching tags
-        query_placeholders = ",".join("?" * len(query_tags))
-        cursor.execute(f"""
-            SELECT path FROM images
-            WHERE EXISTS (
-                SELECT 1 FROM json_each(tags)
-                WHERE lower(json_each.value) IN ({query_placeholders})
-            )
-        """, query_tags)
-        matches = [row[0] for row in cursor.fetchall()]
+            return {"images": db.random_paths(conn, 7)}
         
-        if not matches:
+        # Search for images with matching tags (any of them, case-insensitive)
+        paths = db.paths_with_tags(conn, query_tags, 7)
+        if not paths:
             logger.info("No matches found for query; returning random images")
-            cursor.execute("SELECT path FROM images ORDER BY RANDOM() LIMIT 7")
-            paths = [row[0] for row in cursor.fetchall()]
-        else:
-            paths = random.sample(matches, min(7, len(matches)))
+            paths = db.random_paths(conn, 7)
         
         logger.info(f"Tag search for '{query}' returned {len(paths)} images")
         return {"images": paths}
@@ -113,8 +103,7 @@ def lock_image(image_path: str):
             return {"status": "error", "message": "Image not found"}
         
         # Find image_id from SQLite
-        cursor.execute("SELECT image_id FROM images WHERE path = ?", (image_path,))
-        result = cursor.fetchone()
+        result = pool.connection().execute("SELECT image_id FROM images WHERE path = ?", (image_path,)).fetchone()
         if not result:
             logger.error(f"Image not in database: {image_path}")
             print(f"Image not in database: {image_path}")
@@ -123,11 +112,7 @@ def lock_image(image_path: str):
         image_id = result[0]
         
         # Find Faiss index for the image
-        faiss_idx = None
-        for idx, mapped_id in id_map.items():
-            if mapped_id == image_id:
-                faiss_idx = int(idx)
-                break
+        faiss_idx = id_index.row_for_id(image_id)
         if faiss_idx is None:
             logger.error(f"No Faiss embedding for image_id: {image_id}")
             print(f"No Faiss embedding for {image_path}")
@@ -203,7 +188,7 @@ def save_moodboard():
 def main():
     global locked_embedding
     print("Moodboard Test CLI")
-    print(f"Database: {DB_FILE} ({cursor.execute('SELECT COUNT(*) FROM images').fetchone()[0]} images)")
+    print(f"Database: {DB_FILE} ({pool.connection().execute('SELECT COUNT(*) FROM images').fetchone()[0]} images)")
     print(f"Faiss index: {FAISS_INDEX_FILE} ({index.ntotal} vectors)")
     
     while True:
@@ -236,7 +221,7 @@ def main():
         elif choice == "4":
             print("Exiting...")
             logger.info("Test script terminated")
-            conn.close()
+            pool.close()
             break
         
         else:
@@ -260,5 +245,5 @@ if __name__ == "__main__":
     except Exception as e:
         logger.error(f"Startup error: {e}")
         print(f"Startup error: {e}")
-        if "conn" in globals():
-            conn.close()
\ No newline at end of file
+        if "pool" in globals():
+            pool.close()
\ No newline at end of file
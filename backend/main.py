@@ -1,43 +1,48 @@
 from fastapi import FastAPI
 from fastapi.responses import FileResponse
-from PIL import Image
-import numpy as np
-import faiss
-import json
-import random
 import os
+from moodboard import MoodboardRenderer
+from corpus import Corpus
 
-index = faiss.read_index("data/faiss_index.bin")
-embeddings = np.load("data/embeddings.npy")
-with open("data/metadata.json", "r") as f:
-    metadata = json.load(f)
+corpus = Corpus.load("data")  # Current data bundle, or the legacy flat files
+index, embeddings, metadata = corpus.index, corpus.embeddings, corpus.metadata
+tag_index, tag_scores, id_index = corpus.tag_index, corpus.tag_scores, corpus.id_index
+cluster_index, text_search = corpus.cluster_index, corpus.text_search
+moodboard_renderer = MoodboardRenderer(corpus.atlas, failed=corpus.atlas_failed)
 locked_embedding = None
 
-def search(query: str):
+def search(query: str, mode: str = "or"):
     global locked_embedding
     if locked_embedding is not None:
         distances, indices = index.search(locked_embedding, k=7)
         return {"images": [metadata[i]["path"] for i in indices[0]]}
-    query_tags = query.split(",")
-    matches = [i for i, meta in enumerate(metadata) if any(tag in meta["tags"] for tag in query_tags)]
-    sample_indices = random.sample(matches, min(7, len(matches)))
+    if query == "default" and cluster_index is not None:
+        return {"images": [metadata[i]["path"] for i in cluster_index.sample(7)]}
+    query_tags = [tag.strip() for tag in query.split(",")]
+    if text_search is not None and any(tag not in tag_index.tag_ids for tag in query_tags):
+        return {"images": [metadata[i]["path"] for i in text_search.search(query, k=7)]}
+    if tag_scores is not None:
+        sample_indices = tag_scores.top(query_tags, 7, mode=mode).tolist()  # Best-scoring first
+    else:
+        sample_indices = tag_index.sample(query_tags, 7, mode=mode)
     return {"images": [metadata[i]["path"] for i in sample_indices]}
 
 def lock_image(image_path: str):
     global locked_embedding
-    idx = next(i for i, meta in enumerate(metadata) if meta["path"] == image_path)
-    locked_embedding = embeddings[idx:idx+1]  # Shape: (1, 768)
+    idx = id_index.row(image_path)
+    if idx is None:
+        return {"status": "not indexed"}
+    locked_embedding = embeddings.get(idx)  # Shape: (1, 768)
     return {"status": "locked"}
 
 def save_moodboard():
     global locked_embedding
     images = search("") if locked_embedding is not None else search("default")
-    imgs = [Image.open(path).resize((200, 200)) for path in images["images"]]
-    combined = Image.new("RGB", (800, 400))  # 4x2 grid
-    for i, img in enumerate(imgs[:7]):
-        combined.paste(img, ((i % 4) * 200, (i // 4) * 200))
-    combined.save("moodboard.png")
-    return combined
+    paths = images["images"][:7]
+    data = moodboard_renderer.render(paths, [id_index.row(path) for path in paths])  # 4x2 grid
+    with open("moodboard.png", "wb") as f:
+        f.write(data)
+    return "Moodboard saved to moodboard.png"
 
 def get_image(image_path: str):
     return os.path.join("data/images", image_path)
@@ -54,8 +59,11 @@ def main():
 
         if choice == "1":
             query = input("Enter search query (comma-separated tags): ")
-            result = search(query)
+            mode = "and" if input("Match all tags? (y/N): ").strip().lower() == "y" else "or"
+            result = search(query, mode)
             print("Search results:", result["images"])
+            query_tags = [tag.strip() for tag in query.split(",")]
+            print("Tag counts:", tag_index.facets(tag_index.rows(query_tags, mode)))
 
         elif choice == "2":
             image_path = input("Enter the path of the image to lock: ")
@@ -0,0 +1,182 @@
+import bisect
+import threading
+import time
+
+# Prometheus text exposition (format 0.0.4) without the client library: a few
+# counters and histograms updated under a per-metric lock, plus callbacks that
+# read existing stats (cache hit counts, corpus size) at scrape time.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [per-bucket counts (last is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def time(self, labels=()):
+        """Context manager observing the wall time of its block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                yield self.name + "_bucket", _labels(self.labelnames, labels, [("le", _number(bound))]), cumulative
+            yield self.name + "_sum", _labels(self.labelnames, labels), total
+            yield self.name + "_count", _labels(self.labelnames, labels), cumulative
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+
+
+class Callback:
+    """A gauge or counter whose values come from fn() -> {label values tuple: value} at scrape time."""
+
+    def __init__(self, name, help, kind, labelnames, fn):
+        self.name, self.help, self.kind, self.labelnames = name, help, kind, tuple(labelnames)
+        self.fn = fn
+
+    def samples(self):
+        for labels, value in sorted(self.fn().items()):
+            if value is not None:
+                yield self.name, _labels(self.labelnames, labels), value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, fn, labelnames=(), kind="gauge"):
+        return self.register(Callback(name, help, kind, labelnames, fn))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:  # A failing callback must not break the whole scrape
+                print(f"Error collecting {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.counter("moodboard_requests_total", "HTTP requests by route and status.",
+                            ("method", "route", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("moodboard_request_duration_seconds", "HTTP request latency by route.",
+                                     ("method", "route"))
+STAGE_SECONDS = REGISTRY.histogram("moodboard_stage_duration_seconds",
+                                   "Latency of internal stages (tag_filter, vector_search, sampling, ...).",
+                                   ("stage",))
+
+
+def stage(name):
+    """with stage("vector_search"): ... records the block in the per-stage histogram."""
+    return _Timer(STAGE_SECONDS, (name,))
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing HTTP requests by route template.
+
+    Routes are labelled by their template (/api/images/{image_path:path}),
+    not the concrete URL, to keep the number of series bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            REQUESTS.inc((scope["method"], path, str(status[0])))
+            REQUEST_SECONDS.observe(time.perf_counter() - start, (scope["method"], path))
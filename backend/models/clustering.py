@@ -1,14 +1,149 @@
-from sklearn.mixture import GaussianMixture
+import time
+
+import faiss
 import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+from sklearn.metrics import davies_bouldin_score, silhouette_score
+from sklearn.mixture import GaussianMixture
+
+# "faiss":     k-means on a row sample with faiss.Kmeans (fastest, default)
+# "minibatch": sklearn MiniBatchKMeans streamed over every row in chunks
+# "pca-gmm":   IncrementalPCA streamed over every row, then a diagonal GMM on a sample
+BACKENDS = ("faiss", "minibatch", "pca-gmm")
+DEFAULT_BACKEND = "faiss"
+CHUNK_SIZE = 65_536     # Rows read from the (possibly memory-mapped) embeddings at a time
+SAMPLE_SIZE = 200_000   # Rows used by the sample-based fits
+PCA_COMPONENTS = 64
+QUALITY_SAMPLE = 10_000  # Rows scored for silhouette / Davies-Bouldin
+
+
+def _normalized(vectors):
+    vectors = np.array(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _chunks(embeddings, chunk_size=CHUNK_SIZE, order=None):
+    """Yield normalized float32 chunks; only one chunk of a memmap is resident at a time."""
+    starts = range(0, len(embeddings), chunk_size)
+    for start in (starts if order is None else [starts[i] for i in order]):
+        yield _normalized(embeddings[start:start + chunk_size])
+
+
+def _sample(embeddings, size, rng):
+    if len(embeddings) <= size:
+        return _normalized(embeddings[:])
+    rows = np.sort(rng.choice(len(embeddings), size, replace=False))  # Sorted reads for memmaps
+    return _normalized(embeddings[rows])
+
+
+class Clustering:
+    """A clustering backend fitted over normalized embeddings.
+
+    embeddings may be an in-memory array or a memmap of embeddings.npy: fit()
+    reads it in chunks or as a row sample and predict() labels it chunk by
+    chunk, so memory stays bounded on millions of vectors.
+    """
+
+    def __init__(self, n_clusters=20, backend=DEFAULT_BACKEND, sample_size=SAMPLE_SIZE,
+                 pca_components=PCA_COMPONENTS, epochs=3, seed=42):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown clustering backend {backend!r}; expected one of {BACKENDS}")
+        self.n_clusters = n_clusters
+        self.backend = backend
+        self.sample_size = sample_size
+        self.pca_components = pca_components
+        self.epochs = epochs
+        self.seed = seed
+        self.fit_seconds = None
+
+    def fit(self, embeddings):
+        rng = np.random.default_rng(self.seed)
+        start = time.perf_counter()
+        if self.backend == "faiss":
+            sample = _sample(embeddings, self.sample_size, rng)
+            self.model = faiss.Kmeans(sample.shape[1], self.n_clusters, niter=25, seed=self.seed,
+                                      max_points_per_centroid=max(256, len(sample) // self.n_clusters + 1))
+            self.model.train(sample)
+        elif self.backend == "minibatch":
+            self.model = MiniBatchKMeans(self.n_clusters, random_state=self.seed, n_init=3)
+            n_chunks = -(-len(embeddings) // CHUNK_SIZE)
+            for _ in range(self.epochs):
+                for chunk in _chunks(embeddings, order=rng.permutation(n_chunks)):
+                    if len(chunk) >= self.n_clusters:
+                        self.model.partial_fit(chunk)
+        else:
+            components = min(self.pca_components, embeddings.shape[1], len(embeddings))
+            self.pca = IncrementalPCA(n_components=components)
+            for chunk in _chunks(embeddings):
+                if len(chunk) >= components:
+                    self.pca.partial_fit(chunk)
+            self.model = GaussianMixture(self.n_clusters, covariance_type="diag", random_state=self.seed)
+            self.model.fit(self.pca.transform(_sample(embeddings, self.sample_size, rng)))
+        self.fit_seconds = time.perf_counter() - start
+        return self
+
+    def _predict_chunk(self, chunk):
+        if self.backend == "faiss":
+            return self.model.index.search(chunk, 1)[1][:, 0]
+        if self.backend == "minibatch":
+            return self.model.predict(chunk)
+        return self.model.predict(self.pca.transform(chunk))
+
+    def predict(self, embeddings):
+        """Return int32 labels for every row of embeddings."""
+        labels = np.empty(len(embeddings), dtype=np.int32)
+        for i, chunk in enumerate(_chunks(embeddings)):
+            labels[i * CHUNK_SIZE:i * CHUNK_SIZE + len(chunk)] = self._predict_chunk(chunk)
+        return labels
+
+
+def cluster_quality(embeddings, labels, sample_size=QUALITY_SAMPLE, seed=0):
+    """Silhouette and Davies-Bouldin scores on a row sample, plus cluster size spread."""
+    sizes = np.bincount(labels)
+    report = {"clusters": int((sizes > 0).sum()), "min_size": int(sizes[sizes > 0].min()),
+              "max_size": int(sizes.max())}
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(labels), min(sample_size, len(labels)), replace=False))
+    sample, sample_labels = _normalized(embeddings[rows]), labels[rows]
+    if 1 < len(np.unique(sample_labels)) < len(rows):
+        report["silhouette"] = float(silhouette_score(sample, sample_labels))
+        report["davies_bouldin"] = float(davies_bouldin_score(sample, sample_labels))
+    return report
+
+
+def cluster_embeddings(embeddings, output_file=None, n_clusters=20, backend=DEFAULT_BACKEND, **options):
+    """Fit a backend, label every row and optionally save the labels.
+
+    embeddings may be a path to an .npy file, which is memory-mapped.
+    Returns (labels, report) where report holds timings and quality scores.
+    """
+    if isinstance(embeddings, str):
+        embeddings = np.load(embeddings, mmap_mode="r")
+    if len(embeddings) < n_clusters:
+        n = len(embeddings)
+        return np.zeros(n, dtype=np.int32), {"backend": backend, "clusters": int(n > 0), "min_size": n, "max_size": n}
+    clustering = Clustering(n_clusters, backend, **options).fit(embeddings)
+    start = time.perf_counter()
+    labels = clustering.predict(embeddings)
+    report = {"backend": backend, "fit_seconds": clustering.fit_seconds,
+              "predict_seconds": time.perf_counter() - start}
+    report.update(cluster_quality(embeddings, labels))
+    if output_file is not None:
+        np.save(output_file, labels)
+    return labels, report
+
+
+def format_report(report):
+    parts = [f"{report['clusters']} clusters (sizes {report['min_size']}-{report['max_size']})"]
+    if "fit_seconds" in report:
+        parts.append(f"fit {report['fit_seconds']:.1f}s, predict {report['predict_seconds']:.1f}s")
+    if "silhouette" in report:
+        parts.append(f"silhouette {report['silhouette']:.3f}, Davies-Bouldin {report['davies_bouldin']:.2f}")
+    return ", ".join(parts)
 
-def cluster_embeddings(embeddings_file, output_file, n_clusters=20):
-    embeddings = np.load(embeddings_file)
-    gmm = GaussianMixture(n_components=n_clusters, covariance_type='full', random_state=42)
-    gmm.fit(embeddings)
-    cluster_labels = gmm.predict(embeddings)
-    np.save(output_file, cluster_labels)
-    return cluster_labels
 
 if __name__ == "__main__":
-    cluster_labels = cluster_embeddings("../data/embeddings.npy", "../data/cluster_labels.npy")
-    print(f"Clustered into {len(set(cluster_labels))} clusters.")
\ No newline at end of file
+    cluster_labels, report = cluster_embeddings("../data/embeddings.npy", "../data/cluster_labels.npy")
+    print(f"Clustered with {report['backend']}: {format_report(report)}")
@@ -1,26 +1,137 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
 import torch
-from torchvision import transforms
 from PIL import Image
 import numpy as np
 import os
 
-# Load DINOv2
-dinov2 = torch.hub.load('facebookresearch/dinov2', 'dinov2_vitb14').eval()
+from models.preprocess import dino_transform, load_image
+
+MAX_BATCH = 16        # Images per DINOv2 forward in the embedding worker
+MAX_WAIT = 0.01       # Seconds the worker waits for more requests after the first one arrives
+MAX_PENDING = 256     # Queued images before submit() refuses more
+
+_dinov2 = None
+_dinov2_lock = threading.Lock()
+
+
+def load_dinov2():
+    """DINOv2 ViT-B/14 in eval mode, loaded once per process."""
+    global _dinov2
+    with _dinov2_lock:
+        if _dinov2 is None:
+            _dinov2 = torch.hub.load('facebookresearch/dinov2', 'dinov2_vitb14').eval()
+    return _dinov2
+
+
+def preprocess(image):
+    """DINOv2 input tensor (3, 224, 224) for a path, file object or PIL image, as generate_all.py prepares it."""
+    image = image.convert("RGB") if isinstance(image, Image.Image) else load_image(image)
+    return dino_transform(image)
 
-# Preprocessing
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
 
 def get_embedding(image_path):
-    image = Image.open(image_path).convert("RGB")
-    tensor = transform(image).unsqueeze(0)
     with torch.no_grad():
-        embedding = dinov2(tensor).cpu().numpy()
+        embedding = load_dinov2()(preprocess(image_path).unsqueeze(0)).cpu().numpy()
     return embedding[0]
 
+
+class EmbeddingWorker:
+    """Keeps DINOv2 warm in a background thread and embeds submitted images in micro-batches.
+
+    Callers submit preprocessed tensors and get a Future. The worker takes the
+    first waiting request, gathers more for up to max_wait seconds or until
+    max_batch, and runs them as one forward pass, so a burst of uploads costs
+    a few batched passes instead of one pass each. At most max_pending images
+    wait; beyond that submit() raises queue.Full.
+    """
+
+    def __init__(self, load_model=load_dinov2, max_batch=MAX_BATCH, max_wait=MAX_WAIT, max_pending=MAX_PENDING):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._load_model = load_model
+        self.model = None
+        self.error = None
+        self.ready = threading.Event()
+        self.batches = 0
+        self.items = 0
+        self.seconds = 0.0  # Time in forward passes
+        self.rejected = 0
+        self._thread = threading.Thread(target=self._run, name="embedding-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, tensor):
+        """Queue one (3, H, W) tensor; the Future resolves to its normalized float32 embedding."""
+        if self.error is not None:
+            raise RuntimeError(f"Embedding model failed to load: {self.error}")
+        future = Future()
+        try:
+            self._queue.put_nowait((tensor, future))
+        except queue.Full:
+            self.rejected += 1
+            raise
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            self.model = self._load_model()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            print(f"Embedding worker disabled: {self.error}")
+        self.ready.set()
+        while True:
+            batch = self._collect()
+            futures = [future for _, future in batch if future.set_running_or_notify_cancel()]
+            tensors = [tensor for tensor, future in batch if future.running()]
+            if not futures:
+                continue
+            if self.model is None:
+                for future in futures:
+                    future.set_exception(RuntimeError(f"Embedding model failed to load: {self.error}"))
+                continue
+            start = time.perf_counter()
+            try:
+                with torch.no_grad():
+                    embeddings = self.model(torch.stack(tensors)).cpu().numpy().astype(np.float32)
+                embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.seconds += time.perf_counter() - start
+            self.batches += 1
+            self.items += len(futures)
+            for future, embedding in zip(futures, embeddings):
+                future.set_result(embedding)
+
+    def stats(self):
+        return {
+            "ready": self.ready.is_set() and self.error is None,
+            "error": self.error,
+            "pending": self._queue.qsize(),
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "seconds": round(self.seconds, 3),
+            "rejected": self.rejected,
+        }
+
+
 def generate_embeddings(image_dir, output_file):
     image_paths = [os.path.join(image_dir, f) for f in os.listdir(image_dir) if f.endswith(('.png', '.jpg'))]
     embeddings = np.array([get_embedding(path) for path in image_paths])
@@ -32,4 +143,4 @@ def generate_embeddings(image_dir, output_file):
 
 if __name__ == "__main__":
     image_paths = generate_embeddings("../data/images/", "../data/embeddings.npy")
-    print(f"Generated embeddings for {len(image_paths)} images.")
\ No newline at end of file
+    print(f"Generated embeddings for {len(image_paths)} images.")
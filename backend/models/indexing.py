@@ -0,0 +1,141 @@
+import numpy as np
+import faiss
+
+# FAISS factory strings for the supported index families. "Flat" is exact;
+# the others trade recall for speed and memory as the corpus grows:
+#   "HNSW32"                   graph index, no training, fast and accurate, ~1.1x raw size
+#   "IVF1024,Flat"             inverted lists over exact vectors, needs training
+#   "IVF1024,PQ64"             inverted lists over 64-byte PQ codes, ~48x smaller
+#   "OPQ64,IVF1024,PQ64"       same, with a learned rotation for better PQ recall
+DEFAULT_FACTORY = "Flat"
+TRAIN_SIZE = 100_000   # Max vectors sampled to train IVF/PQ/OPQ stages
+ADD_CHUNK = 65_536     # Vectors normalized and added per index.add call
+
+
+def _normalized(vectors):
+    vectors = np.array(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def train_index(index, embeddings, train_size=TRAIN_SIZE, seed=42):
+    """Train index on a random sample of embeddings if it needs training."""
+    if index.is_trained:
+        return index
+    rng = np.random.default_rng(seed)
+    if len(embeddings) > train_size:
+        rows = np.sort(rng.choice(len(embeddings), train_size, replace=False))
+        sample = embeddings[rows]
+    else:
+        sample = embeddings[:]
+    index.train(_normalized(sample))
+    return index
+
+
+def build_index(embeddings, factory=DEFAULT_FACTORY, train_size=TRAIN_SIZE):
+    """Build an L2 index over the normalized embeddings from a factory string.
+
+    embeddings may be a memmap; it is normalized and added in chunks so the
+    full matrix never needs a second float32 copy in memory.
+    """
+    index = faiss.index_factory(embeddings.shape[1], factory, faiss.METRIC_L2)
+    train_index(index, embeddings, train_size)
+    for start in range(0, len(embeddings), ADD_CHUNK):
+        index.add(_normalized(embeddings[start:start + ADD_CHUNK]))
+    return index
+
+
+def default_search_params(index):
+    """Reasonable query-time parameters for the index family."""
+    params = []
+    if _has_ivf(index):
+        params.append("nprobe=16")
+    if _has_hnsw(index):
+        params.append("efSearch=128")
+    return ",".join(params)
+
+
+def _has_ivf(index):
+    try:
+        faiss.extract_index_ivf(index)
+        return True
+    except RuntimeError:
+        return False
+
+
+def _has_hnsw(index):
+    index = faiss.downcast_index(index)
+    while hasattr(index, "index") and not hasattr(index, "hnsw"):
+        index = faiss.downcast_index(index.index)
+    return hasattr(index, "hnsw")
+
+
+def apply_search_params(index, params):
+    """Set query-time parameters such as "nprobe=16" or "efSearch=100"."""
+    if params:
+        faiss.ParameterSpace().set_index_parameters(index, params)
+    return index
+
+
+def id_mapped(index):
+    """Return index wrapped in IndexIDMap2 so vectors can be removed by id.
+
+    A populated plain index is rebuilt with its implicit row numbers as ids,
+    which keeps existing faiss_id_map.json entries valid.
+    """
+    if isinstance(index, faiss.IndexIDMap2):
+        return index
+    if index.ntotal == 0:
+        return faiss.IndexIDMap2(index)
+    vectors = index.reconstruct_n(0, index.ntotal)
+    index.reset()
+    mapped = faiss.IndexIDMap2(index)
+    mapped.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+    return mapped
+
+
+def reconstruct_ids(index, ids):
+    """Vectors stored under ids in an IndexIDMap2, one row per id.
+
+    IVF indexes get a temporary direct map for the lookup; PQ codes come back
+    as their approximate decoded vectors. Raises RuntimeError if the index
+    cannot reconstruct vectors at all.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    ivf = faiss.extract_index_ivf(index) if _has_ivf(index) else None
+    if ivf is not None:
+        ivf.make_direct_map()
+    try:
+        if len(ids) == 0:
+            return np.zeros((0, index.d), dtype=np.float32)
+        return np.vstack([index.reconstruct(int(i)) for i in ids])
+    finally:
+        if ivf is not None:
+            ivf.make_direct_map(False)  # An array direct map would block remove_ids on the next run
+
+
+def remove_ids(index, ids):
+    """Remove ids from an IndexIDMap2, returning the (possibly rebuilt) index.
+
+    Flat and IVF indexes support removal in place. HNSW does not, so its
+    remaining vectors are reconstructed into a fresh index of the same type.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) == 0:
+        return index
+    try:
+        index.remove_ids(ids)
+        return index
+    except RuntimeError:
+        pass
+    keep = np.setdiff1d(faiss.vector_to_array(index.id_map), ids)
+    vectors = np.vstack([index.reconstruct(int(i)) for i in keep]) if len(keep) else None
+    inner = faiss.downcast_index(index.index)
+    fresh = faiss.clone_index(inner)
+    fresh.reset()
+    if hasattr(fresh, "hnsw"):
+        fresh.hnsw.efConstruction = inner.hnsw.efConstruction
+    rebuilt = faiss.IndexIDMap2(fresh)
+    if vectors is not None:
+        rebuilt.add_with_ids(vectors, keep)
+    return rebuilt
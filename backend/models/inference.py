@@ -0,0 +1,159 @@
+import contextlib
+import copy
+import os
+import time
+
+import numpy as np
+import torch
+
+# CPU inference backends for the image encoders (DINOv2 and the CLIP vision tower):
+#   "eager"    plain fp32 PyTorch
+#   "compile"  torch.compile (inductor); the first batch of each shape pays for compilation
+#   "int8"     dynamic int8 quantization of every nn.Linear (weights int8, activations quantized per batch)
+#   "onnx"     ONNX export run by ONNX Runtime (optional dependency: pip install onnxruntime)
+BACKENDS = ("eager", "compile", "int8", "onnx")
+MIN_COSINE = 0.99          # Mean cosine similarity to fp32 eager outputs needed to accept a backend
+MIN_COSINE_WORST = 0.95    # ... and for the single worst image
+MIN_TAG_AGREEMENT = 0.9    # Mean overlap of each image's top-3 CLIP tags with the fp32 ones
+CHECK_IMAGES = 64          # Real images the check runs on
+
+
+def configure_threads(intra_op=None, inter_op=None):
+    """Set torch's intra-op (per-operator) and inter-op thread pools; returns the resulting sizes.
+
+    The inter-op pool can only be sized before torch runs any parallel work,
+    so call this first thing. Leave room for DataLoader workers: intra_op plus
+    NUM_WORKERS should not exceed the physical cores.
+    """
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            print(f"Could not set inter-op threads to {inter_op}: {e}")
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+class OnnxEncoder:
+    """Callable running an exported encoder in ONNX Runtime on torch tensors."""
+
+    def __init__(self, path, threads=None):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError("The 'onnx' inference backend needs onnxruntime (pip install onnxruntime)") from e
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads or torch.get_num_threads()
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, pixel_values):
+        inputs = {self.input_name: pixel_values.detach().cpu().numpy().astype(np.float32)}
+        return torch.from_numpy(self.session.run(None, inputs)[0])
+
+
+def _attention(query, key, value, attn_mask=None, dropout_p=0.0, is_causal=False, scale=None):
+    """Inference-only scaled_dot_product_attention in plain ops, for the ONNX exporter."""
+    weights = (query @ key.transpose(-2, -1)) * (scale if scale is not None else query.size(-1) ** -0.5)
+    if attn_mask is not None:
+        weights = weights.masked_fill(~attn_mask, float("-inf")) if attn_mask.dtype == torch.bool else weights + attn_mask
+    return weights.softmax(dim=-1) @ value
+
+
+@contextlib.contextmanager
+def _patched(owner, name, value):
+    """Temporarily replace owner.name with value."""
+    original = getattr(owner, name)
+    setattr(owner, name, value)
+    try:
+        yield
+    finally:
+        setattr(owner, name, original)
+
+
+def export_onnx(module, example, path):
+    """Export module(pixel_values) to path with a dynamic batch dimension."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # The TorchScript exporter cannot translate SDPA with an explicit scale (used by
+    # transformers' CLIP attention), so trace through the equivalent plain ops
+    with torch.no_grad(), _patched(torch.nn.functional, "scaled_dot_product_attention", _attention):
+        torch.onnx.export(module, (example,), path, input_names=["pixel_values"], output_names=["features"],
+                          dynamic_axes={"pixel_values": {0: "batch"}, "features": {0: "batch"}}, opset_version=17)
+    return path
+
+
+def build_encoder(module, backend, example, onnx_path=None):
+    """Wrap an eval-mode encoder (pixel_values -> features) for the given backend."""
+    if backend == "eager":
+        return module
+    if backend == "compile":
+        return torch.compile(module)
+    if backend == "int8":
+        return torch.ao.quantization.quantize_dynamic(copy.deepcopy(module), {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == "onnx":
+        return OnnxEncoder(export_onnx(module, example, onnx_path))
+    raise ValueError(f"Unknown inference backend {backend!r}; expected one of {BACKENDS}")
+
+
+def compare(reference, candidate, text_embeddings=None, n_tags=3):
+    """Cosine similarity of candidate to reference features and, given normalized
+    tag text embeddings, the mean overlap of each image's top-n tags."""
+    reference = torch.nn.functional.normalize(reference.float(), dim=-1)
+    candidate = torch.nn.functional.normalize(candidate.float(), dim=-1)
+    cosine = (reference * candidate).sum(dim=-1)
+    report = {"cosine_mean": float(cosine.mean()), "cosine_min": float(cosine.min())}
+    if text_embeddings is not None:
+        text_embeddings = text_embeddings.float().cpu()
+        top_reference = (reference @ text_embeddings.T).topk(n_tags, dim=1).indices.tolist()
+        top_candidate = (candidate @ text_embeddings.T).topk(n_tags, dim=1).indices.tolist()
+        report["tag_agreement"] = float(np.mean([len(set(a) & set(b)) / n_tags
+                                                 for a, b in zip(top_reference, top_candidate)]))
+    return report
+
+
+def accepted(report):
+    return (report["cosine_mean"] >= MIN_COSINE and report["cosine_min"] >= MIN_COSINE_WORST
+            and report.get("tag_agreement", 1.0) >= MIN_TAG_AGREEMENT)
+
+
+def accelerate(module, backend, example, name="encoder", text_embeddings=None, onnx_dir="."):
+    """Return (encoder, report) for module on backend, checked against fp32 eager on example.
+
+    If building the backend fails or its outputs drift past the thresholds
+    above, the eager module is returned instead and report["accepted"] is False.
+    """
+    module = module.eval()
+    with torch.no_grad():
+        reference = module(example)
+    if backend == "eager":
+        return module, {"backend": "eager", "accepted": True}
+    start = time.perf_counter()
+    try:
+        encoder = build_encoder(module, backend, example, os.path.join(onnx_dir, f"{name}.onnx"))
+        with torch.no_grad():
+            candidate = encoder(example)  # Also warms up (compiles) the backend
+    except Exception as e:
+        print(f"{name}: {backend} backend failed ({type(e).__name__}: {e}); using eager fp32")
+        return module, {"backend": backend, "accepted": False, "error": str(e)}
+    report = {"backend": backend, "prepare_seconds": round(time.perf_counter() - start, 2),
+              **compare(reference, candidate, text_embeddings)}
+    report["accepted"] = accepted(report)
+    summary = ", ".join(f"{key} {value:.4f}" for key, value in report.items() if isinstance(value, float))
+    if not report["accepted"]:
+        print(f"{name}: {backend} backend rejected ({summary}); using eager fp32")
+        return module, report
+    print(f"{name}: using {backend} backend ({summary})")
+    return encoder, report
+
+
+def throughput(encoder, batch, repeats=5):
+    """Images per second of encoder on batch, after one warm-up call."""
+    with torch.no_grad():
+        encoder(batch)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            encoder(batch)
+    return repeats * len(batch) / (time.perf_counter() - start)
@@ -0,0 +1,51 @@
+import numpy as np
+import faiss
+import os
+from tqdm import tqdm
+
+K = 100             # Neighbors stored per image
+CHUNK_SIZE = 4096   # Queries per batched FAISS search
+
+
+def build_knn_graph(embeddings, index, output_dir, k=K, chunk_size=CHUNK_SIZE):
+    """Precompute the top-k neighbors of every indexed image.
+
+    Runs one batched index.search per chunk of embeddings and streams the
+    results into N x k .npy files, so the server can memory-map them and
+    answer locked searches without touching FAISS.
+    """
+    n = index.ntotal
+    if len(embeddings) != n:
+        raise ValueError(f"{len(embeddings)} embeddings but {n} vectors in the index")
+    k = min(k, n)
+    indices_file = os.path.join(output_dir, "knn_indices.npy")
+    distances_file = os.path.join(output_dir, "knn_distances.npy")
+    neighbors = np.lib.format.open_memmap(indices_file, mode="w+", dtype=np.int32, shape=(n, k))
+    distances = np.lib.format.open_memmap(distances_file, mode="w+", dtype=np.float32, shape=(n, k))
+
+    print("Building k-NN graph...")
+    for start in tqdm(range(0, n, chunk_size), desc="k-NN batches"):
+        batch = np.array(embeddings[start:start + chunk_size], dtype=np.float32)
+        faiss.normalize_L2(batch)
+        batch_distances, batch_indices = index.search(batch, k)
+        neighbors[start:start + len(batch)] = batch_indices
+        distances[start:start + len(batch)] = batch_distances
+
+    neighbors.flush()
+    distances.flush()
+    return indices_file, distances_file
+
+
+def load_knn_graph(data_dir):
+    """Memory-map the precomputed neighbor matrix, or return None if absent."""
+    indices_file = os.path.join(data_dir, "knn_indices.npy")
+    if not os.path.exists(indices_file):
+        return None
+    return np.load(indices_file, mmap_mode="r")
+
+
+if __name__ == "__main__":
+    embeddings = np.load("../data/embeddings.npy", mmap_mode="r")
+    index = faiss.read_index("../data/faiss_index.bin")
+    indices_file, _ = build_knn_graph(embeddings, index, "../data/")
+    print(f"Wrote {indices_file} ({index.ntotal} x {min(K, index.ntotal)})")
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+Changes = namedtuple("Changes", ["new", "changed", "deleted", "unchanged"])
+
+HASH_CHUNK = 1 << 20
+
+
+def file_hash(path):
+    """Content hash of a file (BLAKE2b, 128-bit)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Record of ingested images keyed by path: size, mtime and content hash.
+
+    Only files whose size or mtime moved are re-hashed, so a no-op run costs
+    one stat() per image. A touched file with identical content counts as
+    unchanged and just gets its stat refreshed.
+    """
+
+    def __init__(self, path, entries=None):
+        self.path = path
+        self.entries = entries or {}
+        self.pending = {}
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, "r") as f:
+            return cls(path, json.load(f))
+
+    def save(self):
+        """Write atomically so an interrupted checkpoint never leaves a torn manifest."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+    def diff(self, image_paths):
+        """Classify image_paths against the manifest; returns Changes of path lists.
+
+        new/changed entries are returned with their fresh stat and hash in
+        self.pending, to be committed with mark_done() once processed.
+        """
+        self.pending = {}
+        new, changed, unchanged = [], [], []
+        for path in image_paths:
+            st = os.stat(path)
+            entry = self.entries.get(path)
+            if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+                unchanged.append(path)
+                continue
+            record = {"size": st.st_size, "mtime": st.st_mtime_ns, "hash": file_hash(path)}
+            if entry is None:
+                new.append(path)
+            elif entry["hash"] != record["hash"]:
+                changed.append(path)
+            else:
+                unchanged.append(path)
+                self.entries[path] = record
+                continue
+            self.pending[path] = record
+        seen = set(image_paths)
+        deleted = [path for path in self.entries if path not in seen]
+        return Changes(new, changed, deleted, unchanged)
+
+    def mark_done(self, paths):
+        for path in paths:
+            record = self.pending.pop(path, None)
+            if record is not None:
+                self.entries[path] = record
+
+    def remove(self, paths):
+        for path in paths:
+            self.entries.pop(path, None)
@@ -0,0 +1,88 @@
+import io
+import time
+
+import torch
+from torch.utils.data import Dataset
+from torchvision import transforms
+from PIL import Image
+
+IMAGE_SIZE = 224  # Input resolution of both DINOv2 vitb14 and CLIP ViT-B/32
+
+# DINOv2: ImageNet statistics on a squashed 224x224 resize (as before)
+dino_transform = transforms.Compose([
+    transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+])
+
+# CLIP: same steps as CLIPProcessor (bicubic shortest-edge resize, center crop)
+clip_transform = transforms.Compose([
+    transforms.Resize(IMAGE_SIZE, interpolation=transforms.InterpolationMode.BICUBIC),
+    transforms.CenterCrop(IMAGE_SIZE),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.48145466, 0.4578275, 0.40821073], std=[0.26862954, 0.26130258, 0.27577711])
+])
+
+
+def load_image(source, min_size=IMAGE_SIZE):
+    """Decode an image as RGB, letting libjpeg downscale large JPEGs while decoding.
+
+    draft() picks the largest DCT scale (1/2, 1/4, 1/8) that keeps both sides
+    at least min_size, so a 4000px original decodes at ~500px for a fraction
+    of the cost. source is a path or a file object.
+    """
+    image = Image.open(source)
+    if image.format == "JPEG":
+        image.draft("RGB", (min_size, min_size))
+    return image.convert("RGB")
+
+
+class SharedImageDataset(Dataset):
+    """Decodes each image once and returns both the DINOv2 and CLIP tensors.
+
+    Items also carry the seconds spent reading, decoding and transforming,
+    which collate_timed() sums per batch for the pipeline profiler.
+    """
+
+    def __init__(self, image_paths):
+        self.image_paths = image_paths
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, idx):
+        path = self.image_paths[idx]
+        try:
+            start = time.perf_counter()
+            with open(path, "rb") as f:
+                data = f.read()
+            read = time.perf_counter()
+            image = load_image(io.BytesIO(data))
+            decoded = time.perf_counter()
+            dino, clip = dino_transform(image), clip_transform(image)
+            timings = {"read": read - start, "decode": decoded - read, "transform": time.perf_counter() - decoded}
+            return dino, clip, path, timings
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            return None, None, path, {}
+
+
+def collate_shared(batch):
+    """Stack the decodable items of a batch; returns (dino, clip, paths, failed_paths)."""
+    valid = [item for item in batch if item[0] is not None]
+    failed = [item[2] for item in batch if item[0] is None]
+    if not valid:
+        return None, None, [], failed
+    return (torch.stack([item[0] for item in valid]),
+            torch.stack([item[1] for item in valid]),
+            [item[2] for item in valid],
+            failed)
+
+
+def collate_timed(batch):
+    """collate_shared() plus {stage: seconds} summed over the batch's decoded items."""
+    timings = {}
+    for item in batch:
+        for stage, seconds in item[3].items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+    return (*collate_shared(batch), timings)
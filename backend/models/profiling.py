@@ -0,0 +1,189 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+RSS_INTERVAL = 0.05  # Seconds between RSS samples while a stage is running
+
+
+def current_rss():
+    """Resident set size of this process in bytes (peak so far where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB on Linux
+
+
+class StageStats:
+    def __init__(self):
+        self.items = 0
+        self.seconds = 0.0  # Busy time in the stage
+        self.wait_seconds = 0.0  # Time blocked waiting for the previous stage's output
+        self.calls = 0
+        self.peak_rss = 0
+        self.workers = 1
+
+
+class PipelineProfiler:
+    """Per-stage throughput, blocked time and peak RSS for a generation run.
+
+    Stages are timed in the main process with `with profiler.stage(name, items)`
+    and `with profiler.wait(name)`; work done elsewhere (DataLoader workers)
+    is added with record(). A sampler thread tracks the peak RSS of this
+    process while each stage is active. Peak RSS of worker processes is not
+    included.
+    """
+
+    def __init__(self, enabled=True, rss_interval=RSS_INTERVAL):
+        self.enabled = enabled
+        self.stages = {}
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._active = {}  # stage -> nesting depth
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if enabled:
+            threading.Thread(target=self._sample_rss, args=(rss_interval,), name="rss-sampler", daemon=True).start()
+
+    def _stats(self, name):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        return stats
+
+    def _sample_rss(self, interval):
+        while not self._stop.wait(interval):
+            self._update_rss()
+
+    def _update_rss(self):
+        rss = current_rss()
+        with self._lock:
+            for name in self._active:
+                stats = self.stages[name]
+                stats.peak_rss = max(stats.peak_rss, rss)
+
+    def stage(self, name, items=0):
+        """Context manager timing one call of a stage; set .items on it if the count is known only later."""
+        return _StageTimer(self, name, items)
+
+    def wait(self, name):
+        """Context manager timing how long stage name is blocked waiting for its input."""
+        return _WaitTimer(self, name)
+
+    def record(self, name, seconds, items=0, workers=1):
+        """Add busy time measured outside this process (e.g. summed over DataLoader workers)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stats(name)
+            stats.seconds += seconds
+            stats.items += items
+            stats.calls += 1
+            stats.workers = workers
+
+    def report(self):
+        wall = time.perf_counter() - self._start
+        stages = {}
+        for name, stats in self.stages.items():
+            # Worker stages run in parallel: their throughput is items per busy second times workers
+            rate = stats.items / stats.seconds * stats.workers if stats.seconds else None
+            stages[name] = {
+                "items": stats.items,
+                "calls": stats.calls,
+                "seconds": round(stats.seconds, 4),
+                "items_per_sec": round(rate, 2) if rate is not None else None,
+                "wait_seconds": round(stats.wait_seconds, 4),
+                "wait_fraction": round(stats.wait_seconds / (stats.seconds + stats.wait_seconds), 4)
+                if stats.seconds + stats.wait_seconds else 0.0,
+                "peak_rss_mb": round(stats.peak_rss / 2**20, 1) if stats.peak_rss else None,
+                "workers": stats.workers,
+            }
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_seconds": round(wall, 3),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                                 / (2**20 if sys.platform == "darwin" else 2**10), 1),
+            "stages": stages,
+        }
+
+    def save(self, path, **info):
+        """Stop sampling and write the report (plus any extra info, e.g. settings) as JSON."""
+        self._stop.set()
+        report = {**info, **self.report()}
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+        return report
+
+
+def format_report(report):
+    lines = [f"{'stage':<14} {'items':>8} {'seconds':>9} {'items/s':>9} {'waiting':>8} {'peak RSS':>10}"]
+    for name, stage in report["stages"].items():
+        rate = f"{stage['items_per_sec']:.1f}" if stage["items_per_sec"] is not None else "-"
+        rss = f"{stage['peak_rss_mb']:.0f} MB" if stage["peak_rss_mb"] is not None else "-"
+        lines.append(f"{name:<14} {stage['items']:>8} {stage['seconds']:>9.2f} {rate:>9} "
+                     f"{stage['wait_fraction']:>7.0%} {rss:>10}")
+    lines.append(f"wall {report['wall_seconds']:.1f} s, peak RSS {report['peak_rss_mb']:.0f} MB")
+    return "\n".join(lines)
+
+
+class _StageTimer:
+    def __init__(self, profiler, name, items):
+        self.profiler, self.name, self.items = profiler, name, items
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler.enabled:
+            with profiler._lock:
+                profiler._stats(self.name)
+                profiler._active[self.name] = profiler._active.get(self.name, 0) + 1
+            profiler._update_rss()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        profiler = self.profiler
+        if not profiler.enabled:
+            return
+        profiler._update_rss()
+        with profiler._lock:
+            stats = profiler.stages[self.name]
+            stats.seconds += seconds
+            stats.items += self.items
+            stats.calls += 1
+            profiler._active[self.name] -= 1
+            if not profiler._active[self.name]:
+                del profiler._active[self.name]
+
+
+class _WaitTimer:
+    def __init__(self, profiler, name):
+        self.profiler, self.name = profiler, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler.enabled:
+            with self.profiler._lock:
+                self.profiler._stats(self.name).wait_seconds += time.perf_counter() - self.start
+
+
+@contextlib.contextmanager
+def torch_trace(path):
+    """Profile the block with torch.profiler and export a Chrome trace (chrome://tracing) to path."""
+    import torch
+
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    with torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True) as prof:
+        yield prof
+    prof.export_chrome_trace(path)
+    print(f"Wrote torch profiler trace to {path}")
@@ -1,12 +1,14 @@
-from transformers import CLIPProcessor, CLIPModel
+from transformers import CLIPProcessor, CLIPModel, CLIPTextModelWithProjection, CLIPTokenizer
 import torch
+from torch.utils.data import DataLoader, Dataset
 from PIL import Image
 import numpy as np
 import json
+import threading
 
-# Load CLIP
-model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+CLIP_MODEL = "openai/clip-vit-base-patch32"
+BATCH_SIZE = 64
+NUM_WORKERS = 4
 
 # Your 109 tags
 tags = [
@@ -31,20 +33,161 @@ tags = [
     "billboard", "pitch deck", "logo system", "ad campaign"
 ]
 
+class ClipImageDataset(Dataset):
+    """Decodes images into CLIP pixel tensors; failed decodes yield None."""
+
+    def __init__(self, image_paths, processor):
+        self.image_paths = image_paths
+        self.processor = processor
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, idx):
+        path = self.image_paths[idx]
+        try:
+            image = Image.open(path).convert("RGB")
+            return self.processor(images=image, return_tensors="pt")["pixel_values"][0], path
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            return None, path
+
+
+def collate_optional(batch):
+    """Stack the decodable tensors of a batch, keeping every path in order."""
+    tensors = [tensor for tensor, _ in batch if tensor is not None]
+    ok = [tensor is not None for tensor, _ in batch]
+    return (torch.stack(tensors) if tensors else None), [path for _, path in batch], ok
+
+
+class ClipImageEncoder(torch.nn.Module):
+    """CLIP's vision tower plus projection as a plain pixel_values -> features module,
+    so it can be compiled, quantized or exported on its own (models/inference.py)."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+
+class TagEngine:
+    """Zero-shot CLIP tagger that encodes the tag vocabulary once.
+
+    Scoring a batch is one image-encoder pass plus a single matrix product
+    against the cached, normalized text embeddings, which is exactly what
+    CLIPModel computes as logits_per_image. image_encoder can be swapped for an
+    accelerated version of ClipImageEncoder(model).
+    """
+
+    def __init__(self, model, processor, tags, device="cpu"):
+        self.model = model.eval()
+        self.processor = processor
+        self.tags = list(tags)
+        self.device = device
+        with torch.no_grad():
+            text_inputs = processor(text=self.tags, return_tensors="pt", padding=True).to(device)
+            text_embeddings = model.get_text_features(**text_inputs)
+            self.text_embeddings = text_embeddings / text_embeddings.norm(dim=-1, keepdim=True)
+            self.logit_scale = model.logit_scale.exp()
+        self.image_encoder = ClipImageEncoder(model)
+
+    @classmethod
+    def from_pretrained(cls, tags, device="cpu", name=CLIP_MODEL):
+        model = CLIPModel.from_pretrained(name).to(device)
+        return cls(model, CLIPProcessor.from_pretrained(name), tags, device)
+
+    def image_features(self, pixel_values):
+        """Normalized CLIP image embeddings for a (B, 3, 224, 224) batch."""
+        with torch.no_grad():
+            features = self.image_encoder(pixel_values.to(self.device)).to(self.device)
+        return features / features.norm(dim=-1, keepdim=True)
+
+    def score(self, pixel_values):
+        """Tag probabilities, shape (B, len(tags))."""
+        return self.score_and_embed(pixel_values)[0]
+
+    def score_and_embed(self, pixel_values):
+        """(tag probabilities, normalized image embeddings) from a single image-encoder pass."""
+        features = self.image_features(pixel_values)
+        logits = self.logit_scale * features @ self.text_embeddings.T
+        return logits.softmax(dim=1).cpu().numpy(), features.cpu().numpy().astype(np.float32)
+
+    def score_images(self, images):
+        pixel_values = self.processor(images=images, return_tensors="pt")["pixel_values"]
+        return self.score(pixel_values)
+
+    def top_tags(self, probs, n=3):
+        return [self.tags[i] for i in np.argsort(probs)[-n:]]
+
+    def score_paths(self, image_paths, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS):
+        """Yield (path, probs) in input order; probs is None for unreadable images."""
+        dataset = ClipImageDataset(image_paths, self.processor)
+        loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers, collate_fn=collate_optional)
+        for pixel_values, paths, ok in loader:
+            probs = iter(self.score(pixel_values)) if pixel_values is not None else iter(())
+            for path, valid in zip(paths, ok):
+                yield path, (next(probs) if valid else None)
+
+
+class ClipTextEncoder:
+    """CLIP's text tower on its own, for embedding free-text search queries.
+
+    Produces the same features as CLIPModel.get_text_features, normalized,
+    without loading the vision tower or encoding the tag vocabulary.
+    """
+
+    def __init__(self, model, tokenizer, device="cpu"):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.device = device
+
+    @classmethod
+    def from_pretrained(cls, device="cpu", name=CLIP_MODEL):
+        return cls(CLIPTextModelWithProjection.from_pretrained(name).to(device), CLIPTokenizer.from_pretrained(name),
+                   device)
+
+    def __call__(self, texts):
+        """Normalized CLIP text embeddings, shape (len(texts), dim) float32."""
+        with torch.no_grad():
+            inputs = self.tokenizer(list(texts), return_tensors="pt", padding=True, truncation=True).to(self.device)
+            features = self.model(**inputs).text_embeds
+        return (features / features.norm(dim=-1, keepdim=True)).cpu().numpy().astype(np.float32)
+
+
+_engine = None
+_text_encoder = None
+_text_encoder_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = TagEngine.from_pretrained(tags)
+    return _engine
+
+
+def get_text_encoder():
+    """The process-wide ClipTextEncoder, shared by every corpus generation."""
+    global _text_encoder
+    with _text_encoder_lock:
+        if _text_encoder is None:
+            _text_encoder = ClipTextEncoder.from_pretrained()
+    return _text_encoder
+
+
 def tag_image(image_path):
+    engine = get_engine()
     image = Image.open(image_path).convert("RGB")
-    inputs = processor(text=tags, images=image, return_tensors="pt", padding=True)
-    with torch.no_grad():
-        outputs = model(**inputs)
-    logits_per_image = outputs.logits_per_image
-    probs = logits_per_image.softmax(dim=1).cpu().numpy()[0]
-    top_tags = [tags[i] for i in np.argsort(probs)[-3:]]  # Top 3 tags
-    return top_tags
+    return engine.top_tags(engine.score_images([image])[0])  # Top 3 tags
 
 def generate_metadata(image_paths_file, output_file):
     with open(image_paths_file, "r") as f:
         image_paths = f.read().splitlines()
-    metadata = [{"path": path, "tags": tag_image(path)} for path in image_paths]
+    engine = get_engine()
+    metadata = [{"path": path, "tags": engine.top_tags(probs) if probs is not None else []}
+                for path, probs in engine.score_paths(image_paths)]
     with open(output_file, "w") as f:
         json.dump(metadata, f)
 
@@ -0,0 +1,128 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from metrics import stage
+
+TILE = 200  # Tile edge in pixels, as in the original 4x2 moodboard
+FORMATS = {"png": ("PNG", "image/png"), "jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+ATLAS_FILE = "tile_atlas.npy"
+ATLAS_FAILED_FILE = "tile_atlas_failed.npy"  # Row mask of placeholder tiles, decoded on demand instead
+COPY_CHUNK = 1024  # Tiles copied per read from a previous atlas (~120 MB)
+
+
+def load_tile(path, tile=TILE):
+    """Decode path into a tile x tile RGB uint8 array (squashed, like the original)."""
+    image = Image.open(path)
+    if image.format == "JPEG":
+        image.draft("RGB", (tile, tile))
+    return np.asarray(image.convert("RGB").resize((tile, tile)), dtype=np.uint8)
+
+
+def build_atlas(paths, output_file, tile=TILE, workers=8, previous=None, previous_rows=None):
+    """Write an N x tile x tile x 3 uint8 atlas whose rows match metadata rows.
+
+    previous is an earlier atlas (and previous_rows, aligned with paths, the
+    row of each path in it or None): its tiles are copied for those paths, and
+    only the rest are decoded. Unreadable images leave a black tile and are
+    marked in a mask saved next to the atlas. Returns (failures, reused).
+    """
+    atlas = np.lib.format.open_memmap(output_file, mode="w+", dtype=np.uint8, shape=(len(paths), tile, tile, 3))
+    failed = np.zeros(len(paths), dtype=bool)
+
+    copies = []
+    if previous is not None and previous_rows is not None and previous.shape[1:] == atlas.shape[1:]:
+        copies = [(row, source) for row, source in enumerate(previous_rows) if source is not None]
+    for start in range(0, len(copies), COPY_CHUNK):
+        rows, sources = zip(*copies[start:start + COPY_CHUNK])
+        atlas[list(rows)] = previous[list(sources)]
+    copied = {row for row, _ in copies}
+
+    def fill(job):
+        row, path = job
+        try:
+            atlas[row] = load_tile(path, tile)
+            return True
+        except Exception as e:
+            print(f"Error building atlas tile for {path}: {e}")
+            failed[row] = True
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        failures = sum(not ok for ok in pool.map(fill, [(row, path) for row, path in enumerate(paths)
+                                                        if row not in copied]))
+    atlas.flush()
+    np.save(os.path.join(os.path.dirname(output_file), ATLAS_FAILED_FILE), failed)
+    return failures, len(copied)
+
+
+def load_atlas(data_dir, expected_rows=None):
+    """Memory-map the tile atlas, or return None if it is absent or stale."""
+    path = os.path.join(data_dir, ATLAS_FILE)
+    if not os.path.exists(path):
+        return None
+    atlas = np.load(path, mmap_mode="r")
+    if expected_rows is not None and len(atlas) != expected_rows:
+        print(f"Ignoring stale tile atlas ({len(atlas)} rows, expected {expected_rows})")
+        return None
+    return atlas
+
+
+def load_atlas_failures(data_dir, expected_rows=None):
+    """Row mask of atlas placeholder tiles, or None (atlases built before the mask existed)."""
+    path = os.path.join(data_dir, ATLAS_FAILED_FILE)
+    if not os.path.exists(path):
+        return None
+    failed = np.load(path)
+    return failed if expected_rows is None or len(failed) == expected_rows else None
+
+
+class MoodboardRenderer:
+    """Composes moodboards in memory from atlas tiles or decoded originals.
+
+    Tiles missing from the atlas (no atlas, a different tile size, no known
+    row, or a row whose tile failed to build) are decoded concurrently on the renderer's thread pool, which
+    can be shared between renderers (e.g. across corpus generations).
+    """
+
+    def __init__(self, atlas=None, workers=8, pool=None, failed=None):
+        self.atlas = atlas
+        self.failed = failed
+        self.pool = pool or ThreadPoolExecutor(max_workers=workers, thread_name_prefix="moodboard")
+
+    def tiles(self, paths, rows=None, tile=TILE):
+        rows = rows if rows is not None else [None] * len(paths)
+        use_atlas = self.atlas is not None and self.atlas.shape[1] == tile
+        tiles = [np.asarray(self.atlas[row]) if use_atlas and row is not None
+                 and (self.failed is None or not self.failed[row]) else None for row in rows]
+        missing = [i for i, t in enumerate(tiles) if t is None]
+        for i, decoded in zip(missing, self.pool.map(lambda i: self._decode(paths[i], tile), missing)):
+            tiles[i] = decoded
+        return [t for t in tiles if t is not None]
+
+    @staticmethod
+    def _decode(path, tile):
+        try:
+            return load_tile(path, tile)
+        except Exception as e:
+            print(f"Error loading image {path}: {e}")
+            return None
+
+    def render(self, paths, rows=None, columns=4, grid_rows=2, tile=TILE, fmt="png"):
+        """Return the encoded moodboard bytes for up to columns * grid_rows images."""
+        count = columns * grid_rows
+        paths = list(paths)[:count]
+        rows = list(rows)[:count] if rows is not None else None
+        canvas = np.zeros((grid_rows * tile, columns * tile, 3), dtype=np.uint8)
+        with stage("image_decode"):  # Atlas reads plus decoding of any tiles not in the atlas
+            tiles = self.tiles(paths, rows, tile)
+        for i, tile_pixels in enumerate(tiles):
+            y, x = (i // columns) * tile, (i % columns) * tile
+            canvas[y:y + tile, x:x + tile] = tile_pixels
+        buffer = io.BytesIO()
+        with stage("moodboard_encode"):
+            Image.fromarray(canvas).save(buffer, format=FORMATS[fmt][0])
+        return buffer.getvalue()
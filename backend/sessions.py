@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+    """Thread-safe bounded mapping that evicts the least recently used key."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SessionLocks:
+    """Locked image path per session (or board) id.
+
+    Paths rather than rows are stored so a lock survives a corpus reload that
+    renumbers the rows.
+
+    Idle sessions are evicted least-recently-used first once max_sessions is
+    reached, so abandoned boards cannot grow the table without bound.
+    """
+
+    def __init__(self, max_sessions=10000):
+        self._locks = LRUCache(max_sessions)
+
+    def get(self, session_id):
+        return self._locks.get(session_id)
+
+    def lock(self, session_id, path):
+        self._locks.put(session_id, path)
+
+    def unlock(self, session_id):
+        return self._locks.pop(session_id) is not None
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class NeighborCache(LRUCache):
+    """Bounded LRU of top-K neighbor rows keyed by the locked row."""
+
+    def get_or_compute(self, row, compute):
+        neighbors = self.get(row)
+        if neighbors is None:
+            neighbors = compute(row)
+            self.put(row, neighbors)
+        return neighbors
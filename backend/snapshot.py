@@ -0,0 +1,180 @@
+import gc
+import os
+import threading
+import time
+
+import faiss
+import numpy as np
+
+import bundle
+from moodboard import MoodboardRenderer
+from sessions import NeighborCache
+
+CLUSTER_SEARCH_MIN_ROWS = 200_000  # Below this a Flat search is already cheap
+
+
+class Snapshot:
+    """One corpus generation plus the serving state derived from it.
+
+    Rows are only meaningful within a snapshot, so row-keyed caches live here
+    too. Handlers take a reference to the current snapshot once per request
+    and use only that, so a reload never mixes rows of two generations.
+    """
+
+    def __init__(self, corpus, neighbors_k=100, neighbor_source="auto", cluster_search="auto",
+                 cluster_nprobe=4, neighbor_cache_size=1024, render_pool=None):
+        self.corpus = corpus
+        self.version = corpus.version
+        self.directory = corpus.directory
+        self.metadata = corpus.metadata
+        self.index = corpus.index
+        self.embeddings = corpus.embeddings
+        self.tag_index = corpus.tag_index
+        self.id_index = corpus.id_index
+        self.tag_scores = corpus.tag_scores
+        self.cluster_index = corpus.cluster_index
+        self.text_search = corpus.text_search
+        if self.text_search is not None:
+            try:
+                self.text_search.warm()  # Off the request path: at startup, or in the reloader's thread
+            except Exception as e:
+                print(f"Free-text search disabled, CLIP text encoder failed to load: {e}")
+                self.text_search = None
+        self.neighbors_k = neighbors_k
+        self.cluster_nprobe = cluster_nprobe
+
+        # "graph" serves locked searches from the precomputed k-NN matrix, "faiss"
+        # always searches the index, "auto" uses the graph when there is one
+        self.knn_graph = corpus.knn_graph if neighbor_source != "faiss" else None
+        if neighbor_source == "graph" and self.knn_graph is None:
+            raise RuntimeError(f"Neighbor source is 'graph' but {corpus.directory} has no usable knn_indices.npy")
+        self.use_cluster_search = self.cluster_index is not None and (
+            cluster_search == "on"
+            or (cluster_search == "auto" and self.index.ntotal >= CLUSTER_SEARCH_MIN_ROWS
+                and isinstance(self.index, faiss.IndexFlat))
+        )
+        if self.use_cluster_search:
+            self.cluster_index.fit_centroids(self.embeddings)
+        self.neighbor_cache = NeighborCache(maxsize=neighbor_cache_size)
+        self.renderer = MoodboardRenderer(corpus.atlas, pool=render_pool, failed=corpus.atlas_failed)
+
+    def __len__(self):
+        return len(self.metadata)
+
+    @property
+    def neighbor_source(self):
+        return "graph" if self.knn_graph is not None else "clusters" if self.use_cluster_search else "faiss"
+
+    def path(self, row):
+        return self.metadata[row]["path"]
+
+    def search_vector(self, vector):
+        """Nearest rows to a DINOv2 embedding, by the same route as locked searches."""
+        if self.use_cluster_search:
+            return self.cluster_index.search(self.embeddings, vector, self.neighbors_k, self.cluster_nprobe)
+        distances, indices = self.index.search(np.asarray(vector, dtype=np.float32).reshape(1, -1), k=self.neighbors_k)
+        return indices[0][indices[0] >= 0]
+
+    def nearest_neighbors(self, row):
+        return self.search_vector(self.embeddings.get(row))
+
+    def locked_neighbors(self, row):
+        if self.knn_graph is not None:
+            neighbors = self.knn_graph[row, :self.neighbors_k]
+            return neighbors[neighbors >= 0]
+        return self.neighbor_cache.get_or_compute(row, self.nearest_neighbors)
+
+    def batch_neighbors(self, rows):
+        """locked_neighbors() for many rows, with every cache miss answered by one index.search."""
+        if self.knn_graph is not None or self.use_cluster_search:
+            return {row: self.locked_neighbors(row) for row in rows}
+        neighbors = {row: self.neighbor_cache.get(row) for row in set(rows)}
+        missing = [row for row, found in neighbors.items() if found is None]
+        if missing:
+            distances, indices = self.index.search(self.embeddings.get(missing), k=self.neighbors_k)
+            for row, found in zip(missing, indices):
+                neighbors[row] = found[found >= 0]
+                self.neighbor_cache.put(row, neighbors[row])
+        return neighbors
+
+
+class CorpusReloader:
+    """Holds the current Snapshot and swaps in new generations without downtime.
+
+    load(verify) builds a complete Snapshot off to the side; only when it has
+    loaded and validated is `current` rebound, a single reference assignment.
+    Requests already holding the old snapshot finish on it, and its arrays and
+    index are freed once the last of them drops the reference.
+    """
+
+    def __init__(self, load, data_dir):
+        self._load = load
+        self.data_dir = data_dir
+        self._lock = threading.Lock()  # One reload at a time
+        self.current = load(verify=False)
+        self.loaded_at = time.time()
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+        self._failed_directory = None  # Not retried by the watcher until a newer bundle is published
+        self._watcher = None
+
+    def changed(self):
+        """True when data/bundles/CURRENT points at a bundle other than the one served."""
+        latest = bundle.current(self.data_dir)
+        return latest is not None and os.path.abspath(latest) != os.path.abspath(self.current.directory)
+
+    def reload(self, force=False):
+        """Load the latest generation and swap it in; returns a status dict.
+
+        Raises on failure, leaving the current snapshot in place.
+        """
+        with self._lock:
+            latest = bundle.current(self.data_dir)
+            if not force and (not self.changed() or latest == self._failed_directory):
+                return {"status": "unchanged", "version": self.current.version}
+            previous = self.current.version
+            try:
+                snapshot = self._load(verify=True)
+                if len(snapshot) == 0:
+                    raise ValueError(f"{snapshot.directory} has no rows")
+            except Exception as e:
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                self._failed_directory = latest
+                raise
+            self.current = snapshot
+            self.loaded_at = time.time()
+            self.reloads += 1
+            self.last_error = None
+            self._failed_directory = None
+        gc.collect()  # Drop the old generation promptly once in-flight requests are done with it
+        return {"status": "reloaded", "version": self.current.version, "previous": previous,
+                "rows": len(self.current)}
+
+    def watch(self, interval):
+        """Poll for a newly published bundle every interval seconds in a daemon thread."""
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    result = self.reload()
+                    if result["status"] == "reloaded":
+                        print(f"Reloaded corpus {result['previous']} -> {result['version']} ({result['rows']} rows)")
+                except Exception as e:
+                    print(f"Corpus reload failed, still serving {self.current.version}: {e}")
+
+        self._watcher = threading.Thread(target=poll, name="corpus-watcher", daemon=True)
+        self._watcher.start()
+
+    def stats(self):
+        return {
+            "version": self.current.version,
+            "directory": self.current.directory,
+            "rows": len(self.current),
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)),
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "watching": self._watcher is not None,
+        }
@@ -0,0 +1,154 @@
+import numpy as np
+
+MODES = ("or", "and")
+
+
+def _contains(postings, values):
+    """Vectorized membership test of values in a sorted posting array."""
+    if len(postings) == 0:
+        return np.zeros(len(values), dtype=bool)
+    pos = np.minimum(np.searchsorted(postings, values), len(postings) - 1)
+    return postings[pos] == values
+
+
+class TagIndex:
+    """Inverted index from tag to the sorted metadata rows carrying it.
+
+    Built once at load time so a search touches only the posting lists of the
+    queried tags instead of scanning every metadata entry.
+    """
+
+    def __init__(self, metadata):
+        postings = {}
+        row_ptr = np.zeros(len(metadata) + 1, dtype=np.int64)
+        for row, meta in enumerate(metadata):
+            for tag in meta["tags"]:
+                postings.setdefault(tag, []).append(row)
+            row_ptr[row + 1] = row_ptr[row] + len(meta["tags"])
+
+        self.tags = sorted(postings)
+        self.tag_ids = {tag: i for i, tag in enumerate(self.tags)}
+        self.postings = {tag: np.unique(np.array(rows, dtype=np.int32)) for tag, rows in postings.items()}
+        self.n_rows = len(metadata)
+
+        # CSR row -> tag ids, used for facet counts over a result set
+        self.row_ptr = row_ptr
+        self.row_tags = np.fromiter(
+            (self.tag_ids[tag] for meta in metadata for tag in meta["tags"]),
+            dtype=np.int32, count=int(row_ptr[-1]),
+        )
+
+    @classmethod
+    def from_bundle(cls, metadata):
+        """Wrap a BundleMetadata's precomputed tag arrays (both directions) without copying."""
+        index = cls.__new__(cls)
+        index.tags = list(metadata.tags)
+        index.tag_ids = {tag: i for i, tag in enumerate(index.tags)}
+        ptr = metadata.postings_ptr
+        index.postings = {tag: metadata.postings[ptr[i]:ptr[i + 1]] for i, tag in enumerate(index.tags)
+                          if ptr[i + 1] > ptr[i]}
+        index.n_rows = len(metadata)
+        index.row_ptr = metadata.tag_ptr
+        index.row_tags = metadata.tag_ids
+        return index
+
+    def _lists(self, tags, mode):
+        if mode not in MODES:
+            raise ValueError(f"Unknown tag match mode {mode!r}; expected one of {MODES}")
+        empty = np.empty(0, dtype=np.int32)
+        lists = [self.postings.get(tag, empty) for tag in dict.fromkeys(tags)]
+        if mode == "and":
+            return sorted(lists, key=len)
+        return [p for p in lists if len(p)]
+
+    def rows(self, tags, mode="or"):
+        """Return the sorted rows matching any ("or") or all ("and") of tags."""
+        lists = self._lists(tags, mode)
+        if not lists:
+            return np.empty(0, dtype=np.int32)
+        if mode == "and":
+            result = lists[0]
+            for postings in lists[1:]:
+                if len(result) == 0:
+                    break
+                result = result[_contains(postings, result)]
+            return result
+        if len(lists) == 1:
+            return lists[0]
+        return np.unique(np.concatenate(lists))
+
+    def sample(self, tags, count, mode="or", rng=None):
+        """Draw up to count distinct matching rows uniformly at random.
+
+        Draws straight from the posting lists, so the full match set is only
+        materialized when it is not much larger than count.
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        lists = self._lists(tags, mode)
+        if count <= 0 or not lists:
+            return []
+        if mode == "and":
+            return self._sample_and(lists, count, rng)
+        return self._sample_or(lists, count, rng)
+
+    def _sample_and(self, lists, count, rng):
+        # Walk the shortest posting list in random order, keeping candidates
+        # that appear in every other list; stop as soon as count are found.
+        smallest, others = lists[0], lists[1:]
+        order = rng.permutation(len(smallest))
+        chunk = max(4 * count, 64)
+        picked = []
+        for start in range(0, len(order), chunk):
+            candidates = smallest[order[start:start + chunk]]
+            for postings in others:
+                candidates = candidates[_contains(postings, candidates)]
+            picked.extend(candidates[:count - len(picked)].tolist())
+            if len(picked) >= count:
+                break
+        return picked
+
+    def _sample_or(self, lists, count, rng, max_rounds=8):
+        sizes = np.array([len(p) for p in lists], dtype=np.int64)
+        total = int(sizes.sum())
+        if len(lists) == 1 or total <= 4 * count:
+            matches = lists[0] if len(lists) == 1 else np.unique(np.concatenate(lists))
+            if len(matches) <= count:
+                return rng.permutation(matches).tolist()
+            return matches[rng.choice(len(matches), count, replace=False)].tolist()
+
+        # Union sampling: pick a posting list proportionally to its length and
+        # a uniform element of it, accepting the element only when the list is
+        # the first one containing it. Accepted draws are uniform over the union.
+        picked = {}
+        for _ in range(max_rounds):
+            needed = count - len(picked)
+            owners = rng.choice(len(lists), 2 * needed, p=sizes / total)
+            for j in np.unique(owners):
+                postings = lists[j]
+                draws = postings[rng.integers(len(postings), size=int((owners == j).sum()))]
+                for earlier in lists[:j]:
+                    draws = draws[~_contains(earlier, draws)]
+                for row in draws.tolist():
+                    picked.setdefault(row, None)
+            if len(picked) >= count:
+                break
+        else:
+            # Heavily overlapping lists; fall back to the exact union
+            return self._sample_or([np.unique(np.concatenate(lists))], count, rng)
+        rows = list(picked)
+        if len(rows) > count:
+            rows = [rows[i] for i in rng.choice(len(rows), count, replace=False)]
+        return rows
+
+    def facets(self, rows):
+        """Return per-tag counts over the given rows, most frequent first."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return {}
+        starts = self.row_ptr[rows]
+        lengths = self.row_ptr[rows + 1] - starts
+        offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + (np.arange(int(lengths.sum())) - offsets)
+        counts = np.bincount(self.row_tags[positions], minlength=len(self.tags))
+        order = np.argsort(-counts, kind="stable")
+        return {self.tags[i]: int(counts[i]) for i in order if counts[i]}
@@ -0,0 +1,66 @@
+import json
+import os
+
+import numpy as np
+
+PROBS_FILE = "tag_probs.npy"
+NAMES_FILE = "tag_names.json"
+
+
+def save_tag_probs(probs, tags, output_dir):
+    """Write the N x len(tags) CLIP tag probabilities as a tag-major float16 matrix.
+
+    Stored transposed so each tag's column is one contiguous run on disk and
+    scoring a query only pages in the queried tags.
+    """
+    np.save(os.path.join(output_dir, PROBS_FILE), np.ascontiguousarray(np.asarray(probs, dtype=np.float16).T))
+    with open(os.path.join(output_dir, NAMES_FILE), "w") as f:
+        json.dump(list(tags), f)
+
+
+class TagScores:
+    """Ranks images for a tag query by their CLIP tag probabilities."""
+
+    def __init__(self, probs, tags):
+        self.probs = probs  # (len(tags), n_rows) float16, usually a memmap
+        self.tags = list(tags)
+        self.tag_ids = {tag: i for i, tag in enumerate(self.tags)}
+
+    @classmethod
+    def load(cls, data_dir, expected_rows=None):
+        """Memory-map the probability matrix, or return None if it is absent or stale."""
+        probs_path, names_path = os.path.join(data_dir, PROBS_FILE), os.path.join(data_dir, NAMES_FILE)
+        if not (os.path.exists(probs_path) and os.path.exists(names_path)):
+            return None
+        probs = np.load(probs_path, mmap_mode="r")
+        with open(names_path, "r") as f:
+            tags = json.load(f)
+        if len(tags) != probs.shape[0] or (expected_rows is not None and probs.shape[1] != expected_rows):
+            print(f"Ignoring stale tag probabilities ({probs.shape}, expected {expected_rows} rows)")
+            return None
+        return cls(probs, tags)
+
+    def scores(self, tags, mode="or"):
+        """Per-row score: sum of the tags' probabilities ("or") or their product ("and").
+
+        Returns None when nothing can match (no known tag, or an unknown tag under "and").
+        """
+        columns = [self.tag_ids[tag] for tag in dict.fromkeys(tags) if tag in self.tag_ids]
+        if not columns or (mode == "and" and len(columns) < len(set(tags))):
+            return None
+        scores = np.array(self.probs[columns[0]], dtype=np.float32)
+        for column in columns[1:]:
+            if mode == "and":
+                scores *= self.probs[column]
+            else:
+                scores += self.probs[column]
+        return scores
+
+    def top(self, tags, k, mode="or"):
+        """Rows of the k best-scoring images for tags, best first."""
+        scores = self.scores(tags, mode)
+        if scores is None or k <= 0:
+            return np.empty(0, dtype=np.int64)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
@@ -0,0 +1,22 @@
+# Tag vocabulary CLIP scores every image against in generate_all.py
+TAGS = [
+    "illustration", "collage", "3D render", "motion graphics", "animation", "painting", "drawing",
+    "sculpture", "printmaking", "installation art", "AR/VR", "AI-generated", "cinematography",
+    "fashion design", "product design", "industrial design", "UI design", "architecture",
+    "interior design", "layout", "grid system", "negative space", "balance", "asymmetry",
+    "overlap", "depth", "iconography", "diagram", "map", "infographic", "emoji", "logomark",
+    "pictogram", "double exposure", "halftone", "glitch", "pixel art", "datamoshing", "silhouette",
+    "line art", "scanography", "hand-drawn", "metal", "glass", "concrete", "plastic", "paper",
+    "fabric", "wood", "skin", "fur", "water", "fire", "smoke", "dust", "mirror", "black & white",
+    "monochrome", "neon", "pastel", "primary colors", "complementary", "analogous", "duotone",
+    "CMYK", "RGB", "warm", "cool", "neutral", "vivid", "muted", "earth tones", "sunset tones",
+    "underwater tones", "futuristic palette", "natural palette", "nostalgic palette",
+    "psychedelic colors", "vaporwave palette", "minimal palette", "high contrast", "brutalism",
+    "minimalism", "maximalism", "cyberpunk", "solarpunk", "biophilic", "memphis", "bauhaus",
+    "de stijl", "baroque", "vintage", "retro-futurism", "Y2K", "new ugly", "editorial",
+    "high fashion", "corporate memphis", "dada", "surrealism", "art deco", "modernist",
+    "dreamy", "gritty", "ethereal", "industrial", "romantic", "playful", "melancholy", "serene",
+    "bold", "mysterious", "chaotic", "clinical", "organic", "eerie", "luxurious",
+    "editorial layout", "poster design", "book cover", "packaging", "social post", "web landing page",
+    "billboard", "pitch deck", "logo system", "ad campaign"
+]
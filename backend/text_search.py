@@ -0,0 +1,59 @@
+import os
+import threading
+
+import faiss
+
+from models.tagging import get_text_encoder
+from sessions import LRUCache
+
+INDEX_FILE = "clip_index.bin"
+
+
+class TextSearch:
+    """Free-text search over the CLIP image-embedding index.
+
+    Each distinct query string is run through the CLIP text encoder once while
+    it stays in the LRU. Call warm() before serving so loading the encoder
+    does not land on the first free-text request.
+    """
+
+    def __init__(self, index, encode=None, cache_size=4096):
+        self.index = index
+        self.cache = LRUCache(cache_size)
+        self._encode = encode
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, data_dir, expected_rows=None, cache_size=4096):
+        """Read the CLIP index, or return None if it is absent or stale."""
+        path = os.path.join(data_dir, INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        index = faiss.read_index(path)
+        if expected_rows is not None and index.ntotal != expected_rows:
+            print(f"Ignoring stale CLIP index ({index.ntotal} rows, expected {expected_rows})")
+            return None
+        return cls(index, cache_size=cache_size)
+
+    def encoder(self):
+        with self._lock:
+            if self._encode is None:
+                self._encode = get_text_encoder()
+            return self._encode
+
+    def warm(self):
+        """Load the text encoder and run it once."""
+        self.encoder()(["warm up"])
+
+    def embed(self, query):
+        key = " ".join(query.lower().split())  # CLIP's tokenizer ignores case and spacing anyway
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.encoder()([key])
+            self.cache.put(key, vector)
+        return vector
+
+    def search(self, query, k=100):
+        """Rows of the k images closest to query, best first."""
+        distances, indices = self.index.search(self.embed(query), k)
+        return indices[0][indices[0] >= 0]
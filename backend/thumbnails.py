@@ -0,0 +1,105 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from metrics import stage
+from sessions import LRUCache
+
+SIZES = (128, 256, 512)  # Allowed longest-edge sizes, so the cache cannot be filled with arbitrary renditions
+FORMATS = {
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+}
+QUALITY = 80
+
+
+def render(source, size, fmt="webp", quality=QUALITY):
+    """Resize source so its longest edge is at most size and encode it."""
+    image = Image.open(source)
+    if image.format == "JPEG":
+        image.draft("RGB", (size, size))  # Let libjpeg skip most of the full-resolution decode
+    image = image.convert("RGB")
+    image.thumbnail((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format=FORMATS[fmt][0], quality=quality)
+    return buffer.getvalue()
+
+
+def _opaque_tag(etag):
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match check: "*" or an exact entity-tag in the list (weak comparison, W/ ignored)."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or _opaque_tag(etag) in {_opaque_tag(candidate) for candidate in candidates}
+
+
+class ThumbnailCache:
+    """Resized renditions cached on disk and, for the hottest ones, in memory.
+
+    Disk entries live at <cache_dir>/<size>/<sha1(source)><ext> and are
+    re-rendered when the source is newer. The ETag changes with the source's
+    mtime and size, so clients revalidate cheaply with If-None-Match.
+    """
+
+    def __init__(self, cache_dir, memory_items=4096):
+        self.cache_dir = cache_dir
+        self.memory = LRUCache(memory_items)
+
+    def disk_path(self, source, size, fmt):
+        name = hashlib.sha1(os.path.abspath(source).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, str(size), name + FORMATS[fmt][2])
+
+    @staticmethod
+    def etag(source, size, fmt):
+        st = os.stat(source)
+        digest = hashlib.sha1(f"{os.path.abspath(source)}|{st.st_mtime_ns}|{st.st_size}".encode("utf-8"))
+        return f'"{digest.hexdigest()[:16]}-{size}-{fmt}"'
+
+    def load(self, source, size, fmt="webp"):
+        """Read the rendition from disk, rendering and storing it if missing or stale."""
+        path = self.disk_path(source, size, fmt)
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source):
+            with stage("thumbnail_read"), open(path, "rb") as f:
+                return f.read()
+        with stage("thumbnail_render"):
+            data = render(source, size, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return data
+
+    def get(self, source, size, fmt="webp"):
+        """Return (data, etag) for the rendition, rendering it at most once."""
+        if size not in SIZES or fmt not in FORMATS:
+            raise ValueError(f"Unsupported thumbnail {size}/{fmt}")
+        etag = self.etag(source, size, fmt)
+        cached = self.memory.get((source, size, fmt))
+        if cached is not None and cached[1] == etag:
+            return cached
+        data = self.load(source, size, fmt)
+        self.memory.put((source, size, fmt), (data, etag))
+        return data, etag
+
+    def pregenerate(self, sources, sizes=SIZES, fmt="webp", workers=8):
+        """Render every missing rendition to disk; returns the number of failures."""
+        def render_one(job):
+            try:
+                self.load(*job, fmt)
+                return True
+            except Exception as e:
+                print(f"Error rendering thumbnail for {job[0]}: {e}")
+                return False
+
+        jobs = [(source, size) for source in sources for size in sizes]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return sum(not ok for ok in pool.map(render_one, jobs))